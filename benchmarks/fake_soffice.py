@@ -0,0 +1,43 @@
+"""Stand-in for LibreOffice's soffice, used by the benchmarks so that they run without LibreOffice installed.
+
+Supports only what the program uses: `--convert-to pdf DOCUMENT --outdir DIRECTORY` creates a PDF with one page
+per 40 lines of the document (read as text). Starting a background instance (`--accept=...`) always fails,
+so the program falls back to a conversion per document, like with a LibreOffice that cannot listen.
+FAKE_SOFFICE_DELAY (in seconds) is slept before every conversion, to imitate the startup time of LibreOffice.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+import pymupdf
+
+LINES_PER_PAGE = 40
+
+
+def convert(document: Path, output_directory: Path):
+    with open(document, "r", encoding="utf8", errors="replace") as fp:
+        lines = fp.read().splitlines() or [""]
+    pdf = pymupdf.open()
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        page = pdf.new_page()
+        page.insert_text((50, 60), "\n".join(lines[start : start + LINES_PER_PAGE]), fontsize=10)
+    pdf.set_metadata({})
+    os.makedirs(output_directory, exist_ok=True)
+    pdf.save(output_directory.joinpath(document.with_suffix(".pdf").name), no_new_id=True)
+
+
+def main(args: list[str]) -> int:
+    if any(arg.startswith("--accept") for arg in args):
+        return 1
+    if "--convert-to" not in args or "--outdir" not in args:
+        return 2
+    document = Path(args[args.index("--convert-to") + 2])
+    output_directory = Path(args[args.index("--outdir") + 1])
+    time.sleep(float(os.environ.get("FAKE_SOFFICE_DELAY", "0")))
+    convert(document, output_directory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
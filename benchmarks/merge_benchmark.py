@@ -0,0 +1,345 @@
+"""Measures merge throughput on a generated corpus.
+
+The corpus is generated deterministically (same seed and scale give the same files): PDFs with varying page counts,
+JPEG, PNG and TIFF images of different resolutions and text-based office documents. Documents are converted
+by fake_soffice.py, so the benchmark runs offline without LibreOffice.
+
+Every scenario runs merge_documents.py in a separate process (best of --repeat runs) and reports files/s, pages/s,
+peak RSS of the run and the output size. Results can be saved as a baseline (--save-baseline FILE) and compared
+with it later (--baseline FILE). Baselines depend on the computer, so none is shipped - save one on your machine
+before making changes:
+
+    python benchmarks/merge_benchmark.py --save-baseline baseline.json
+    python benchmarks/merge_benchmark.py [--scale 2] [--repeat 3] --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+import pymupdf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+BENCHMARK_DIR = Path(__file__).parent
+REPOSITORY_DIR = BENCHMARK_DIR.parent
+sys.path.insert(0, str(REPOSITORY_DIR))
+
+# pylint: disable=wrong-import-position
+from implementation.configuration import Configuration
+from implementation.logger import format_size, set_quiet
+
+SEED = 2024
+# Runs the merge and prints its wall time and peak RSS (ru_maxrss of children, kilobytes or bytes on macOS).
+# A child forked from the benchmark itself would count the memory of the benchmark (pymupdf, the corpus)
+# in its peak RSS, so merges are started from this small process instead.
+MEASURE_SCRIPT = """
+import resource, subprocess, sys, time
+start = time.perf_counter()
+code = subprocess.call(sys.argv[1:], stdout=subprocess.DEVNULL)
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+sys.exit(code)
+"""
+# resolutions of generated images, the number of images of every format is a multiple of their count
+IMAGE_SIZES = [(640, 480), (1600, 1200), (2400, 3200)]
+
+# scenario name -> (input directory in the corpus, settings of the configuration)
+SCENARIOS: dict[str, tuple[str, dict]] = {
+    "pdf": ("pdf", {}),
+    "images": ("images", {}),
+    "images-resampled": ("images", {"max_image_dpi": 150, "image_quality": 75}),
+    "documents": ("documents", {}),
+    "mixed": (".", {}),
+    "mixed-jobs": (".", {"jobs": 0}),
+    "mixed-streaming": (".", {"streaming_merge": True}),
+    "mixed-memory-budget": (".", {"memory_budget": 16}),
+    "mixed-compact": (".", {"compact_output": True}),
+    "mixed-split": (".", {"split_pages": 100, "jobs": 0}),
+}
+
+
+class Result(NamedTuple):
+    files: int
+    pages: int
+    seconds: float
+    peak_rss: int | None
+    output_size: int
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds
+
+
+def write_tiff(path: Path, width: int, height: int, samples: bytes):
+    """Writes an uncompressed RGB TIFF (MuPDF cannot write TIFF)."""
+    entries = [
+        (256, 4, 1, width),  # ImageWidth
+        (257, 4, 1, height),  # ImageLength
+        (258, 3, 3, 0),  # BitsPerSample, offset filled in below
+        (259, 3, 1, 1),  # Compression: none
+        (262, 3, 1, 2),  # PhotometricInterpretation: RGB
+        (273, 4, 1, 0),  # StripOffsets, filled in below
+        (277, 3, 1, 3),  # SamplesPerPixel
+        (278, 4, 1, height),  # RowsPerStrip
+        (279, 4, 1, len(samples)),  # StripByteCounts
+    ]
+    directory_size = 2 + 12 * len(entries) + 4
+    bits_offset = 8 + directory_size
+    data_offset = bits_offset + 6
+    with open(path, "wb") as fp:
+        fp.write(struct.pack("<2sHI", b"II", 42, 8))
+        fp.write(struct.pack("<H", len(entries)))
+        for tag, field_type, count, value in entries:
+            if tag == 258:
+                value = bits_offset
+            elif tag == 273:
+                value = data_offset
+            if field_type == 3 and count == 1:
+                fp.write(struct.pack("<HHIHH", tag, field_type, count, value, 0))
+            else:
+                fp.write(struct.pack("<HHII", tag, field_type, count, value))
+        fp.write(struct.pack("<I", 0))
+        fp.write(struct.pack("<HHH", 8, 8, 8))
+        fp.write(samples)
+
+
+def make_pixmap(rng: random.Random, width: int, height: int) -> pymupdf.Pixmap:
+    """Returns a noisy gradient, which compresses about as badly as a photo. Rows are shifted copies of one row,
+    so that even large images are generated quickly.
+    """
+    row = bytes(min(255, (x * 255 // (3 * width)) + rng.randrange(64)) for x in range(3 * width))
+    samples = b"".join(row[(3 * y) % len(row) :] + row[: (3 * y) % len(row)] for y in range(height))
+    return pymupdf.Pixmap(pymupdf.csRGB, width, height, samples, False)
+
+
+def generate_corpus(directory: Path, scale: int, seed: int = SEED) -> dict[str, int]:
+    """Creates the corpus in the directory. Returns the number of files in every subdirectory."""
+    rng = random.Random(seed)
+    counts = {}
+    pdf_directory = directory.joinpath("pdf")
+    pdf_directory.mkdir(parents=True)
+    for i in range(20 * scale):
+        pdf = pymupdf.open()
+        width, height = rng.choice([pymupdf.paper_size("a4"), pymupdf.paper_size("letter")])
+        for page_number in range(rng.randint(1, 30)):
+            page = pdf.new_page(width=width, height=height)
+            page.insert_text((72, 72), f"Document {i}, page {page_number + 1}", fontsize=20)
+            page.draw_rect(pymupdf.Rect(72, 100, width - 72, height - 72), color=(0, 0, 0))
+        pdf.set_metadata({})
+        pdf.save(pdf_directory.joinpath(f"document_{i}.pdf"), no_new_id=True)
+    counts["pdf"] = 20 * scale
+    image_directory = directory.joinpath("images")
+    image_directory.mkdir()
+    for i in range(4 * scale):
+        for width, height in IMAGE_SIZES:
+            pixmap = make_pixmap(rng, width, height)
+            name = f"image_{i}_{width}x{height}"
+            image_directory.joinpath(f"{name}.jpg").write_bytes(pixmap.tobytes("jpg", jpg_quality=85))
+            pixmap.save(image_directory.joinpath(f"{name}.png"))
+            write_tiff(image_directory.joinpath(f"{name}.tiff"), width, height, pixmap.samples)
+    counts["images"] = 4 * scale * len(IMAGE_SIZES) * 3
+    document_directory = directory.joinpath("documents")
+    document_directory.mkdir()
+    for i in range(6 * scale):
+        line_count = rng.randint(5, 200)
+        lines = [f"Line {n} of document {i}: " + "lorem ipsum " * rng.randint(1, 8) for n in range(line_count)]
+        extension = [".txt", ".csv", ".rtf"][i % 3]
+        document_directory.joinpath(f"note_{i}{extension}").write_text("\n".join(lines), encoding="utf8")
+    counts["documents"] = 6 * scale
+    counts["."] = counts["pdf"] + counts["images"] + counts["documents"]
+    return counts
+
+
+def create_fake_soffice(directory: Path) -> Path:
+    """Creates a launcher of fake_soffice.py, which runs it with this Python interpreter."""
+    script = BENCHMARK_DIR.joinpath("fake_soffice.py").absolute()
+    if os.name == "nt":
+        launcher = directory.joinpath("soffice.cmd")
+        launcher.write_text(f'@"{sys.executable}" "{script}" %*\n', encoding="utf8")
+    else:
+        launcher = directory.joinpath("soffice")
+        launcher.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n', encoding="utf8")
+        launcher.chmod(0o755)
+    return launcher
+
+
+def write_config(path: Path, soffice: Path, settings: dict):
+    config = Configuration()
+    config.update_from_dictlike(
+        {
+            "libreoffice_path": [str(soffice)],
+            "conversion_cache_size": 0,  # every run should convert the documents
+            "alphabetic_file_sorting": False,
+            "confirm_exit": False,
+            "quiet": True,
+            "recursion_limit": 5,
+            **settings,
+        }
+    )
+    config.save_config(path)
+
+
+def run_merge(corpus: Path, input_directory: str, config_name: str, output_name: str) -> tuple[float, int | None]:
+    """Runs merge_documents.py in the corpus directory.
+    Returns the wall time and the peak RSS of the run (the largest of the merge and its worker processes,
+    if it can be measured).
+    """
+    # paths are relative, because the program treats arguments starting with '/' as options
+    command = [
+        sys.executable,
+        str(REPOSITORY_DIR.joinpath("merge_documents.py")),
+        input_directory,
+        "-c",
+        config_name,
+        "-o",
+        output_name,
+    ]
+    if resource is None:
+        start = time.perf_counter()
+        returncode = subprocess.call(command, cwd=corpus, stdout=subprocess.DEVNULL)
+        seconds, peak_rss = time.perf_counter() - start, None
+    else:
+        process = subprocess.run(
+            [sys.executable, "-c", MEASURE_SCRIPT] + command, cwd=corpus, stdout=subprocess.PIPE, check=False
+        )
+        returncode = process.returncode
+        seconds_text, peak_text = process.stdout.decode().split()
+        seconds = float(seconds_text)
+        peak_rss = int(peak_text) if sys.platform == "darwin" else int(peak_text) * 1024
+    if returncode != 0:
+        raise RuntimeError(f"Merge failed with exit code {returncode}: {' '.join(command)}")
+    return seconds, peak_rss
+
+
+def run_scenario(corpus: Path, soffice: Path, name: str, file_count: int, repeat: int) -> Result:
+    input_directory, settings = SCENARIOS[name]
+    # outside of the corpus, so that they are not merged
+    config_path = corpus.parent.joinpath(f"{name}.toml")
+    write_config(config_path, soffice, settings)
+    output = corpus.parent.joinpath(f"{name}.pdf")
+    runs = [run_merge(corpus, input_directory, f"../{config_path.name}", f"../{output.name}") for _ in range(repeat)]
+    seconds = min(run[0] for run in runs)
+    peak_rsses = [run[1] for run in runs if run[1] is not None]
+    # a split output is saved as parts named after the output
+    outputs = [output] if output.exists() else sorted(output.parent.glob(f"{output.stem}_*.pdf"))
+    pages = output_size = 0
+    for path in outputs:
+        with pymupdf.open(path) as merged:
+            pages += merged.page_count
+        output_size += path.stat().st_size
+        path.unlink()
+    return Result(file_count, pages, seconds, max(peak_rsses) if peak_rsses else None, output_size)
+
+
+def read_baseline(path: Path, scale: int) -> dict[str, dict]:
+    """Returns results of scenarios in the baseline, or no results if it was measured with another scale."""
+    with open(path, "r", encoding="utf8") as fp:
+        baseline = json.load(fp)
+    if baseline.get("scale") != scale:
+        print(f"Baseline {path} was measured with scale {baseline.get('scale')}, not used.", file=sys.stderr)
+        return {}
+    return baseline.get("scenarios", {})
+
+
+def format_change(current: float, baseline: float | None, higher_is_better: bool) -> str:
+    if not baseline:
+        return ""
+    change = (current - baseline) / baseline * 100
+    worse = change < 0 if higher_is_better else change > 0
+    return f" ({change:+.1f}%{'!' if worse and abs(change) >= 5 else ''})"
+
+
+def print_results(results: dict[str, Result], baseline: dict[str, dict]):
+    print(f"{'scenario':<22}{'files/s':>16}{'pages/s':>18}{'peak RSS':>22}{'output':>22}")
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        files_per_second = f"{result.files_per_second:.1f}" + format_change(
+            result.files_per_second, base.get("files_per_second"), True
+        )
+        pages_per_second = f"{result.pages_per_second:.1f}" + format_change(
+            result.pages_per_second, base.get("pages_per_second"), True
+        )
+        peak_rss = "-"
+        if result.peak_rss is not None:
+            peak_rss = format_size(result.peak_rss) + format_change(result.peak_rss, base.get("peak_rss"), False)
+        output_size = format_size(result.output_size) + format_change(
+            result.output_size, base.get("output_size"), False
+        )
+        print(f"{name:<22}{files_per_second:>16}{pages_per_second:>18}{peak_rss:>22}{output_size:>22}")
+
+
+def to_json(result: Result) -> dict:
+    return result._asdict() | {
+        "files_per_second": result.files_per_second,
+        "pages_per_second": result.pages_per_second,
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="Multiplies the number of files in the corpus.")
+    parser.add_argument("--repeat", type=int, default=3, help="How many times every scenario is run (best is used).")
+    parser.add_argument(
+        "--scenario", action="append", choices=list(SCENARIOS), help="Runs only this scenario (can be repeated)."
+    )
+    parser.add_argument(
+        "--soffice-delay",
+        type=float,
+        default=0.0,
+        help="Seconds the fake soffice waits before every conversion, to imitate LibreOffice startup.",
+    )
+    parser.add_argument("--baseline", type=Path, help="Baseline file to compare with.")
+    parser.add_argument(
+        "--save-baseline", type=Path, metavar="FILE", help="Saves the results as a baseline (other scenarios are kept)."
+    )
+    parser.add_argument("--keep-corpus", type=Path, help="Generates the corpus in this directory and keeps it.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.baseline and not args.baseline.exists():
+        raise SystemExit(f"Baseline {args.baseline} does not exist, save one with --save-baseline first.")
+    set_quiet(True)
+    os.environ["FAKE_SOFFICE_DELAY"] = str(args.soffice_delay)
+    corpus = args.keep_corpus or Path(tempfile.mkdtemp(prefix="merge_benchmark_"))
+    try:
+        if corpus.exists() and any(corpus.iterdir()):
+            raise SystemExit(f"Corpus directory {corpus} is not empty.")
+        file_counts = generate_corpus(corpus.joinpath("corpus"), args.scale)
+        soffice = create_fake_soffice(corpus)
+        results = {}
+        for name in args.scenario or SCENARIOS:
+            results[name] = run_scenario(
+                corpus.joinpath("corpus"), soffice, name, file_counts[SCENARIOS[name][0]], args.repeat
+            )
+            print(f"{name}: {results[name].seconds:.2f} s", file=sys.stderr)
+        baseline = read_baseline(args.baseline, args.scale) if args.baseline else {}
+        print_results(results, baseline)
+        if args.save_baseline:
+            saved = read_baseline(args.save_baseline, args.scale) if args.save_baseline.exists() else {}
+            scenarios = saved | {name: to_json(result) for name, result in results.items()}
+            with open(args.save_baseline, "w", encoding="utf8") as fp:
+                json.dump({"scale": args.scale, "scenarios": scenarios}, fp, indent=2)
+    finally:
+        if args.keep_corpus is None:
+            shutil.rmtree(corpus, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Measures how directory search scales with the size and shape of the tree.
+
+Generates synthetic trees (a deep chain of directories, one wide directory and a balanced tree, all with a mix
+of supported and unsupported files) and searches them like recurse_files does, for several recursion limits.
+Reports the time spent listing directories, sorting names naturally and printing the tree (to os.devnull),
+the time of the streaming walker (iterate_files), the number of directory listings and stat calls,
+and the memory kept by the tree per node.
+
+    python benchmarks/scan_benchmark.py [--wide-entries 100000] [--depth 100] [--repeat 3]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Generator
+
+BENCHMARK_DIR = Path(__file__).parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+
+# pylint: disable=wrong-import-position
+from implementation import files
+from implementation.files import FoldedPath, ScanFilter, iterate_files
+from implementation.logger import set_quiet
+
+# every directory gets files with these extensions in turn, half of them are not supported
+EXTENSIONS = [".pdf", ".zip", ".jpg", ".tmp", ".docx", ".bak", ".png", ".db"]
+
+
+@dataclass
+class Measurement:
+    nodes: int = 0
+    kept_files: int = 0
+    scan_time: float = 0.0
+    sort_time: float = 0.0
+    print_time: float = 0.0
+    walk_time: float = 0.0
+    scandir_calls: int = 0
+    stat_calls: int = 0
+    bytes_per_node: float = 0.0
+
+
+def create_files(directory: Path, count: int):
+    for i in range(count):
+        directory.joinpath(f"file {i}{EXTENSIONS[i % len(EXTENSIONS)]}").touch()
+
+
+def create_deep_tree(root: Path, depth: int, files_per_directory: int):
+    directory = root
+    for level in range(depth):
+        directory = directory.joinpath(f"level {level}")
+        directory.mkdir(parents=True)
+        create_files(directory, files_per_directory)
+
+
+def create_wide_tree(root: Path, entries: int):
+    root.mkdir(parents=True)
+    create_files(root, entries)
+
+
+def create_balanced_tree(root: Path, branching: int, depth: int, files_per_directory: int):
+    root.mkdir(parents=True)
+    create_files(root, files_per_directory)
+    if depth == 0:
+        return
+    for i in range(branching):
+        create_balanced_tree(root.joinpath(f"branch {i}"), branching, depth - 1, files_per_directory)
+
+
+@contextmanager
+def count_calls(measurement: Measurement) -> Generator[None, None, None]:
+    """Counts directory listings and stat calls (e.g. from Path.is_dir) made with the block."""
+    original_scandir = os.scandir
+    original_stat = os.stat
+
+    def scandir(*args, **kwargs):
+        measurement.scandir_calls += 1
+        return original_scandir(*args, **kwargs)
+
+    def stat(*args, **kwargs):
+        measurement.stat_calls += 1
+        return original_stat(*args, **kwargs)
+
+    os.scandir = scandir
+    os.stat = stat
+    try:
+        yield
+    finally:
+        os.scandir = original_scandir
+        os.stat = original_stat
+
+
+@contextmanager
+def time_sorting(measurement: Measurement) -> Generator[None, None, None]:
+    """Adds the time spent in natural sorting during the block to the measurement."""
+    original_natsorted: Callable = files.natsorted
+
+    def natsorted(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_natsorted(*args, **kwargs)
+        finally:
+            measurement.sort_time += time.perf_counter() - start
+
+    files.natsorted = natsorted
+    try:
+        yield
+    finally:
+        files.natsorted = original_natsorted
+
+
+def count_nodes(folded_path: FoldedPath) -> tuple[int, int]:
+    """Returns the number of directories and the number of kept files in the tree."""
+    directories, kept_files = 1, len(folded_path.files)
+    for directory in folded_path.directories:
+        child_directories, child_files = count_nodes(directory)
+        directories += child_directories
+        kept_files += child_files
+    return directories, kept_files
+
+
+def measure(root: Path, recursion_limit: int) -> Measurement:
+    measurement = Measurement()
+    with count_calls(measurement), time_sorting(measurement):
+        start = time.perf_counter()
+        folded_path = FoldedPath(root)
+        folded_path.populate(0, recursion_limit, ScanFilter())
+        measurement.scan_time = time.perf_counter() - start - measurement.sort_time
+    directories, measurement.kept_files = count_nodes(folded_path)
+    measurement.nodes = directories + measurement.kept_files
+    with open(os.devnull, "w", encoding="utf8") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        folded_path.print()
+        measurement.print_time = time.perf_counter() - start
+    del folded_path
+    start = time.perf_counter()
+    for _ in iterate_files([str(root)], False, recursion_limit, ScanFilter()):
+        pass
+    measurement.walk_time = time.perf_counter() - start
+    # separate run, tracing allocations slows it down
+    tracemalloc.start()
+    folded_path = FoldedPath(root)
+    folded_path.populate(0, recursion_limit, ScanFilter())
+    measurement.bytes_per_node = tracemalloc.get_traced_memory()[0] / measurement.nodes
+    tracemalloc.stop()
+    return measurement
+
+
+def best_of(root: Path, recursion_limit: int, repeat: int) -> Measurement:
+    measurements = [measure(root, recursion_limit) for _ in range(repeat)]
+    return min(measurements, key=lambda m: m.scan_time + m.sort_time + m.print_time)
+
+
+def print_row(tree: str, recursion_limit: int, m: Measurement):
+    print(
+        f"{tree:<10}{recursion_limit:>7}{m.nodes:>10}{m.kept_files:>10}"
+        f"{m.scan_time:>10.3f}{m.sort_time:>10.3f}{m.print_time:>10.3f}{m.walk_time:>10.3f}"
+        f"{m.scandir_calls:>10}{m.stat_calls:>8}{m.bytes_per_node:>10.0f}"
+    )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=100, help="Depth of the deep tree.")
+    parser.add_argument("--wide-entries", type=int, default=100_000, help="Number of files in the wide directory.")
+    parser.add_argument("--branching", type=int, default=6, help="Subdirectories per directory of the balanced tree.")
+    parser.add_argument("--files-per-directory", type=int, default=16, help="Files in every directory.")
+    parser.add_argument("--repeat", type=int, default=3, help="How many times every search is run (best is used).")
+    parser.add_argument("--keep-trees", type=Path, help="Generates the trees in this directory and keeps them.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    set_quiet(False)  # the tree has to be printed to be measured
+    workspace = args.keep_trees or Path(tempfile.mkdtemp(prefix="scan_benchmark_"))
+    try:
+        trees = {
+            "deep": (workspace.joinpath("deep"), [5, args.depth // 4, args.depth + 1]),
+            "wide": (workspace.joinpath("wide"), [1]),
+            "balanced": (workspace.joinpath("balanced"), [2, 3, 5]),
+        }
+        if not trees["deep"][0].exists():
+            create_deep_tree(trees["deep"][0], args.depth, args.files_per_directory)
+        if not trees["wide"][0].exists():
+            create_wide_tree(trees["wide"][0], args.wide_entries)
+        if not trees["balanced"][0].exists():
+            create_balanced_tree(trees["balanced"][0], args.branching, 4, args.files_per_directory)
+        print(
+            f"{'tree':<10}{'limit':>7}{'nodes':>10}{'kept':>10}{'scan s':>10}{'sort s':>10}{'print s':>10}"
+            f"{'walk s':>10}{'scandir':>10}{'stat':>8}{'B/node':>10}"
+        )
+        for name, (root, recursion_limits) in trees.items():
+            for recursion_limit in recursion_limits:
+                print_row(name, recursion_limit, best_of(root, recursion_limit, args.repeat))
+    finally:
+        if args.keep_trees is None:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
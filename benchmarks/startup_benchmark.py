@@ -0,0 +1,130 @@
+"""Measures how long the program takes to start and which modules it imports on the quick paths.
+
+Runs merge_documents.py in a separate process for every scenario: printing help, finding an output up to date
+(skip_unchanged, nothing is merged) and a small merge in "what if" mode. Reports the first (cold) run, the best
+of --repeat runs and the time spent importing modules (from python -X importtime).
+
+Quick paths (help and up-to-date) must not import modules that only merging needs, and their best time must stay
+under --budget milliseconds. The benchmark exits with code 1 if they do not.
+
+    python benchmarks/startup_benchmark.py [--repeat 5] [--budget 300]
+"""
+
+import argparse
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+import pymupdf
+
+BENCHMARK_DIR = Path(__file__).parent
+REPOSITORY_DIR = BENCHMARK_DIR.parent
+sys.path.insert(0, str(REPOSITORY_DIR))
+
+# pylint: disable=wrong-import-position
+from implementation.configuration import Configuration
+from implementation.logger import set_quiet
+
+MERGING_MODULES = ["pymupdf", "natsort", "http.server"]
+# scenario name -> (arguments, modules which must not be imported or None if the scenario has no budget)
+SCENARIOS: dict[str, tuple[list[str], list[str] | None]] = {
+    "help": (["--help"], MERGING_MODULES + ["tomlkit"]),
+    "up-to-date": (
+        ["input", "-c", "config.toml", "-o", "output.pdf", "--skip-unchanged"],
+        ["pymupdf", "rich_argparse", "http.server"],
+    ),
+    "whatif": (["input", "-c", "config.toml", "-o", "output.pdf", "--whatif"], None),
+}
+IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)")
+
+
+class Result(NamedTuple):
+    first_seconds: float
+    best_seconds: float
+    import_seconds: float
+    imported: list[str]
+
+
+def create_workspace(directory: Path, file_count: int):
+    """Creates small PDFs to merge, the configuration and an output that is up to date."""
+    input_directory = directory.joinpath("input")
+    input_directory.mkdir(parents=True)
+    for i in range(file_count):
+        pdf = pymupdf.open()
+        pdf.new_page().insert_text((50, 60), f"Page {i}")
+        pdf.save(input_directory.joinpath(f"{i}.pdf"))
+    config = Configuration()
+    config.update_from_dictlike({"confirm_exit": False, "quiet": True})
+    config.save_config(directory.joinpath("config.toml"))
+    run(directory, SCENARIOS["up-to-date"][0])  # the first run merges
+
+
+def run(directory: Path, arguments: list[str], importtime: bool = False) -> tuple[float, str]:
+    """Runs the program in the directory. Returns the wall time and its standard error output."""
+    # paths are relative, because the program treats arguments starting with '/' as options
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    command += [str(REPOSITORY_DIR.joinpath("merge_documents.py"))] + arguments
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"Run failed with exit code {process.returncode}: {' '.join(command)}")
+    return seconds, process.stderr.decode("utf8", errors="replace")
+
+
+def measure(directory: Path, arguments: list[str], repeat: int) -> Result:
+    times = [run(directory, arguments)[0] for _ in range(repeat)]
+    _, importtime = run(directory, arguments, importtime=True)
+    import_microseconds = 0
+    imported = []
+    for match in IMPORT_LINE.finditer(importtime):
+        imported.append(match.group(3))
+        if not match.group(2):  # only top-level imports, the nested ones are included in them
+            import_microseconds += int(match.group(1))
+    return Result(times[0], min(times), import_microseconds / 1_000_000, imported)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="How many times every scenario is run (best is used).")
+    parser.add_argument("--budget", type=float, default=300, help="Budget of the quick paths, in milliseconds.")
+    parser.add_argument("--files", type=int, default=20, help="Number of PDFs in the merged directory.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_arguments()
+    set_quiet(True)
+    workspace = Path(tempfile.mkdtemp(prefix="startup_benchmark_"))
+    failures = []
+    try:
+        create_workspace(workspace, args.files)
+        print(f"{'scenario':<12}{'first ms':>10}{'best ms':>10}{'import ms':>11}  heavy modules")
+        for name, (arguments, forbidden_modules) in SCENARIOS.items():
+            result = measure(workspace, arguments, args.repeat)
+            heavy = [x for x in MERGING_MODULES + ["tomlkit", "rich_argparse"] if x in result.imported]
+            print(
+                f"{name:<12}{result.first_seconds * 1000:>10.0f}{result.best_seconds * 1000:>10.0f}"
+                f"{result.import_seconds * 1000:>11.0f}  {', '.join(heavy) or '-'}"
+            )
+            if forbidden_modules is None:
+                continue
+            for module in forbidden_modules:
+                if module in result.imported:
+                    failures.append(f"{name}: imports {module}")
+            milliseconds = result.best_seconds * 1000
+            if milliseconds > args.budget:
+                failures.append(f"{name}: {milliseconds:.0f} ms is over the budget of {args.budget:.0f} ms")
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
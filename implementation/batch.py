@@ -0,0 +1,212 @@
+import copy
+import json
+import multiprocessing
+import signal
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import fields
+from pathlib import Path
+from typing import NamedTuple, Sequence
+from .configuration import Configuration, Settings
+from .files import ScanFilter, generate_name, iterate_files, recurse_files
+from .libre import set_worker_slot
+from .logger import printline, printlog, set_language_from_file, set_quiet
+from .manifest import input_fingerprint, is_up_to_date
+from .parallel import resolve_worker_count
+from .profiling import finish_profiling, measure, measure_iteration, start_profiling, stop_profiling
+
+# keys of a job which are not settings
+JOB_KEYS = ("files", "output_file")
+SETTING_KEYS = frozenset(x.name.lstrip("_") for x in fields(Configuration))
+# settings of the whole program run, which a job cannot change (jobs of the merge server come from other programs)
+RUN_SETTING_KEYS = frozenset(
+    ["libreoffice_path", "output_directory", "language", "confirm_exit"]
+    + [x for x in SETTING_KEYS if x.startswith(("batch_", "server_"))]
+)
+
+
+class Job(NamedTuple):
+    files: list[str]
+    output_file: str
+    settings: Settings
+    """Settings of the configuration, with values given by the job overriding them."""
+
+
+class JobResult(NamedTuple):
+    number: int
+    output: Path
+    status: str
+    """Localization key of the summary line: JobMerged, JobUpToDate or JobFailed."""
+    pages: int = 0
+    seconds: float = 0.0
+    error: str = ""
+
+
+def get_output_path(output_file: str | None, config: Settings) -> Path:
+    if output_file:  # Output_file has precedence if specified
+        return Path(output_file)
+    return generate_name(config.output_directory)
+
+
+def run_merge(files: Sequence[str], output: Path, config: Settings, force: bool) -> int | None:
+    """Searches the given paths and merges the found files into the output.
+    Returns the number of pages of the output, or None if skip_unchanged found it up to date.
+    """
+    if config.profile:
+        start_profiling()
+    # GET FILES
+    scan_filter = ScanFilter(config.include_patterns, config.exclude_patterns, config.ignore_file_name)
+    if config.streaming_merge:  # directories are searched during the merge
+        files_to_process = measure_iteration(
+            "scan", iterate_files(files, config.alphabetic_file_sorting, config.recursion_limit, scan_filter)
+        )
+    else:
+        with measure("scan"):
+            files_to_process = recurse_files(
+                files, config.alphabetic_file_sorting, config.recursion_limit, scan_filter, config.print_file_tree
+            )
+    # SKIP IF UP TO DATE
+    split = config.split_pages > 0 or config.split_size > 0
+    fingerprint = ""
+    if config.skip_unchanged and not split:  # parts are not recorded in a manifest, so they are always merged
+        files_to_process = list(files_to_process)  # the whole list is needed, even when streaming
+        fingerprint = input_fingerprint(files_to_process, config.output_settings(), config.fingerprint_contents)
+        if not force and is_up_to_date(output.with_suffix(".pdf"), fingerprint):
+            stop_profiling()
+            printline()
+            printlog("UpToDate", output.with_suffix(".pdf"))
+            return None
+    # MERGE
+    # imports pymupdf, not needed if up to date
+    # pylint: disable=import-outside-toplevel
+    from .merge import merge_documents, merge_split_documents, merge_streamed_documents
+
+    if split:  # the whole list is needed, even when streaming
+        pages = merge_split_documents(list(files_to_process), output, config)
+    elif config.streaming_merge:
+        pages = merge_streamed_documents(files_to_process, output, config, fingerprint)
+    else:
+        pages = merge_documents(files_to_process, output, config, fingerprint)
+    finish_profiling(output.with_suffix(".pdf"), save_report=not config.whatif)
+    if config.whatif:
+        printline()
+        printlog("WhatIfMode")
+    return pages
+
+
+def parse_job(entry, number: int, config: Configuration, settings: Settings, program_dir: Path) -> Job:
+    """Checks a job and resolves its settings: `settings` (resolved `config`) with values of the job overriding them.
+    Raises ValueError if the job or one of its values is invalid.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError(f"job {number} is not a table")
+    files = entry.get("files")
+    if isinstance(files, str):
+        files = [files]
+    if not files or not isinstance(files, list) or not all(isinstance(x, str) for x in files):
+        raise ValueError(f"job {number} has no list of files")
+    output_file = entry.get("output_file")
+    if not output_file or not isinstance(output_file, str):
+        raise ValueError(f"job {number} has no output_file")
+    overrides = {key: value for key, value in entry.items() if key not in JOB_KEYS}
+    for key in overrides:
+        if key in RUN_SETTING_KEYS:
+            raise ValueError(f"job {number} cannot change {key}")
+        if key not in SETTING_KEYS:
+            printlog("BatchUnknownSetting", number, key)
+    if overrides:
+        job_config = copy.deepcopy(config)
+        job_config.update_from_dictlike(overrides)
+        try:
+            settings = job_config.resolve(program_dir)
+        except ValueError as e:
+            raise ValueError(f"job {number} has invalid {e}") from e
+    return Job(files, output_file, settings)
+
+
+def read_jobs(path: Path, config: Configuration, settings: Settings, program_dir: Path) -> list[Job]:
+    """Reads jobs from a TOML file (a [[job]] table for every job) or from a JSON Lines file (.jsonl),
+    with an object for every job.
+    """
+    from tomlkit import load  # pylint: disable=import-outside-toplevel
+
+    with open(path, "r", encoding="utf8") as fp:
+        if path.suffix.lower() == ".jsonl":
+            entries = [json.loads(line) for line in fp if line.strip()]
+        else:
+            entries = load(fp).unwrap().get("job", [])
+    if not isinstance(entries, list):
+        raise ValueError("'job' is not an array of tables")
+    return [parse_job(entry, number, config, settings, program_dir) for number, entry in enumerate(entries, start=1)]
+
+
+def load_jobs(path: str | Path, config: Configuration, settings: Settings, program_dir: Path) -> list[Job]:
+    """Reads and checks all jobs, so that an invalid job is reported before anything is merged."""
+    try:
+        return read_jobs(Path(path), config, settings, program_dir)
+    except (OSError, ValueError) as e:  # TOMLKitError is a ValueError too
+        printlog("BatchFileInvalid", path, e)
+        sys.exit(1)
+
+
+def run_job(job: Job, number: int, force: bool) -> JobResult:
+    """Merges one job. Errors fail only this job."""
+    output = get_output_path(job.output_file, job.settings).with_suffix(".pdf")
+    start = time.perf_counter()
+    try:
+        printline()
+        printlog("JobStarted", number, output)
+        pages = run_merge(job.files, output, job.settings, force)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return JobResult(number, output, "JobFailed", 0, time.perf_counter() - start, str(e) or type(e).__name__)
+    status = "JobUpToDate" if pages is None else "JobMerged"
+    return JobResult(number, output, status, pages or 0, time.perf_counter() - start)
+
+
+def init_job_worker(program_dir: Path, language: str, slots):
+    with slots.get_lock():
+        slots.value += 1
+        slot = slots.value  # slot 0 is left for the main process
+    set_worker_slot(slot)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # CTRL-C is handled by the main process
+    set_language_from_file(program_dir, language)
+    set_quiet(True)  # messages of jobs merged at the same time would be mixed up
+
+
+def start_job_pool(workers: int, config: Settings, program_dir: Path) -> ProcessPoolExecutor:
+    """Starts processes running jobs at the same time. Every process converts documents with its own
+    LibreOffice profiles, so that jobs do not block each other.
+    """
+    slots = multiprocessing.Value("i", 0)
+    return ProcessPoolExecutor(workers, initializer=init_job_worker, initargs=(program_dir, config.language, slots))
+
+
+def run_batch(jobs: Sequence[Job], config: Settings, program_dir: Path, force: bool) -> list[JobResult]:
+    """Runs all jobs in this process, `config.batch_workers` of them at the same time (each in a worker process
+    started once for the whole batch). Returns their results in the order of the jobs.
+    """
+    workers = resolve_worker_count(config.batch_workers, len(jobs))
+    if workers <= 1:
+        return [run_job(job, number, force) for number, job in enumerate(jobs, start=1)]
+    with start_job_pool(workers, config, program_dir) as pool:
+        futures: list[Future[JobResult]] = [
+            pool.submit(run_job, job, number, force) for number, job in enumerate(jobs, start=1)
+        ]
+        results = []
+        for number, (job, future) in enumerate(zip(jobs, futures), start=1):
+            try:
+                results.append(future.result())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # the worker process crashed
+                output = Path(job.output_file).with_suffix(".pdf")
+                results.append(JobResult(number, output, "JobFailed", error=str(e) or type(e).__name__))
+    return results
+
+
+def print_batch_summary(results: Sequence[JobResult], seconds: float):
+    printline()
+    failed = sum(1 for x in results if x.status == "JobFailed")
+    printlog("BatchSummary", f"{seconds:.2f}", len(results), failed)
+    for result in results:
+        printlog(result.status, result.number, result.output, result.pages, f"{result.seconds:.2f}", result.error)
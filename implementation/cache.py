@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+INDEX_NAME = "index.json"
+LOCK_NAME = "cache.lock"
+HASH_CHUNK_SIZE = 1024 * 1024
+# PDFs used less than this many seconds ago are not evicted, as another run may be merging them
+EVICTION_GRACE_PERIOD = 60 * 60
+
+
+def hash_file(path: Path) -> str:
+    """Returns the SHA-256 of the file's contents."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while chunk := fp.read(HASH_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@contextmanager
+def lock_file(path: Path) -> Generator[None, None, None]:
+    """Holds an exclusive lock of the file (created if missing), shared by all processes."""
+    with open(path, "a+b") as fp:
+        if fcntl is not None:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        else:
+            # pylint: disable=import-outside-toplevel
+            import msvcrt
+
+            fp.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)  # gives up after 10 seconds
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ConversionCache:
+    """Stores PDFs converted from office documents, keyed by the SHA-256 of the document's contents.
+
+    Hashing a document requires reading it, so the hash is remembered together with the document's path,
+    size and modification time. If those did not change since the last run, the remembered hash is used.
+    When the cache grows over `max_size` bytes, least recently used PDFs are removed.
+    PDFs used during this run are never removed until the cache is closed.
+
+    The cache directory is shared by all runs of the program, also those running at the same time.
+    The index and the PDFs are only changed while holding a lock file. A PDF used by another run cannot
+    be pinned, so PDFs used in the last EVICTION_GRACE_PERIOD seconds are not removed either.
+    """
+
+    def __init__(self, directory: Path, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pinned: set[str] = set()
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._index = self._read_index()
+
+    @contextmanager
+    def _locked(self) -> Generator[None, None, None]:
+        with self._lock, lock_file(self.directory.joinpath(LOCK_NAME)):
+            yield
+
+    def _read_index(self) -> dict[str, dict]:
+        try:
+            with open(self.directory.joinpath(INDEX_NAME), "r", encoding="utf8") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def key(self, document_path: Path) -> str:
+        path = str(document_path.absolute())
+        stat = document_path.stat()
+        with self._lock:
+            entry = self._index.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["hash"]
+        digest = hash_file(document_path)
+        with self._lock:
+            self._index[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+        return digest
+
+    def _cached_path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{key}.pdf")
+
+    def get(self, key: str) -> Path | None:
+        """Returns the cached PDF for the key or None if it is not cached."""
+        cached = self._cached_path(key)
+        with self._locked():
+            if not cached.exists():
+                return None
+            self._pinned.add(key)
+            os.utime(cached)  # modification time marks when the file was last used
+        return cached
+
+    def put(self, key: str, converted_pdf: Path) -> Path:
+        """Moves the converted PDF into the cache and returns its new path."""
+        cached = self._cached_path(key)
+        with self._locked():
+            shutil.move(converted_pdf, cached)
+            self._pinned.add(key)
+            self._evict()
+        return cached
+
+    def _evict(self):
+        entries = []
+        for path in self.directory.glob("*.pdf"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        entries.sort(key=lambda x: x[1].st_mtime_ns)
+        total_size = sum(stat.st_size for _, stat in entries)
+        recently_used = time.time() - EVICTION_GRACE_PERIOD
+        for path, stat in entries:
+            if total_size <= self.max_size or stat.st_mtime >= recently_used:
+                break  # sorted by the time of use, so all further PDFs are recently used too
+            if path.stem in self._pinned:
+                continue
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:  # open in another process on Windows
+                continue
+            total_size -= stat.st_size
+
+    def close(self):
+        """Evicts files used during this run if needed and saves the index, together with the entries
+        saved by other runs in the meantime.
+        """
+        with self._locked():
+            self._pinned.clear()
+            self._evict()
+            index = self._read_index()
+            index.update(self._index)
+            self._index = {k: v for k, v in index.items() if self._cached_path(v["hash"]).exists()}
+            index_path = self.directory.joinpath(INDEX_NAME)
+            temp_index_path = index_path.with_suffix(".tmp")
+            with open(temp_index_path, "w", encoding="utf8") as fp:
+                json.dump(self._index, fp)
+            os.replace(temp_index_path, index_path)
@@ -1,8 +1,7 @@
 import argparse
 from pathlib import Path
 import sys
-import rich_argparse
-from implementation.configuration import Configuration
+from implementation.configuration import Configuration, Settings
 from implementation import configuration
 from implementation.logger import printlog, log, set_quiet
 
@@ -33,12 +32,28 @@ def load_config(cmd_args, default_config_path):
     return config
 
 
-def parse_arguments(help_override: bool = False):
+def resolve_config(config: Configuration, program_dir: Path) -> Settings:
+    """Checks and resolves the configuration once, before anything is merged. Exits if a value is invalid."""
+    try:
+        return config.resolve(program_dir)
+    except ValueError as e:
+        printlog("ConfigInvalid", e)
+        wait_for_confirm(wait=config.confirm_exit and not config.quiet)
+        sys.exit(1)
+
+
+def rich_help_formatter(prog: str) -> argparse.HelpFormatter:
+    """Help is formatted only when it is printed, so rich_argparse (slow to import) is not imported otherwise."""
+    import rich_argparse  # pylint: disable=import-outside-toplevel
+
     rich_argparse.RichHelpFormatter.styles["argparse.metavar"] = "magenta"
     rich_argparse.RichHelpFormatter.styles["argparse.prog"] = "b i"
     rich_argparse.RichHelpFormatter.styles["argparse.groups"] = "dark_orange b"
+    return rich_argparse.RichHelpFormatter(prog, max_help_position=12)
+
+
+def parse_arguments(help_override: bool = False):
     parser = argparse.ArgumentParser(
-        formatter_class=(lambda prog: rich_argparse.RichHelpFormatter(prog, max_help_position=12)),
         add_help=False,
         prefix_chars="-/",
         # formatter_class=argparse.RawTextHelpFormatter,
@@ -79,6 +94,32 @@ def parse_arguments(help_override: bool = False):
         action="store_true",
         help="If present, runs the program, but outputs no files. Overrides --quiet",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="If present, files are merged even if skip_unchanged finds the output up to date.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        metavar="BATCH_FILE",
+        action="store",
+        help=(
+            "Path to a file with merge jobs, which are all run by this one program run. "
+            "TOML with a [[job]] table for every job, or JSON Lines (.jsonl) with an object for every job. "
+            "Every job has 'files' (list of paths), 'output_file' and optionally any settings of "
+            "the configuration file, which override the configuration for that job. "
+            "Files given on the command line are ignored."
+        ),
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "If present, runs a merge server on this computer instead of merging, until stopped with CTRL-C. "
+            "Other programs send it merge jobs (like in a batch file) over HTTP. See README for details."
+        ),
+    )
     parser.add_argument(
         "-l",
         "--language",
@@ -108,6 +149,134 @@ def parse_arguments(help_override: bool = False):
         type=int,
         help=configuration.RECURSION_DESCRIPTION,
     )
+    parameters_args.add_argument(
+        "--include",
+        "--include-patterns",
+        dest="include_patterns",
+        nargs="*",
+        metavar="PATTERN",
+        help=configuration.INCLUDE_PATTERNS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--exclude",
+        "--exclude-patterns",
+        dest="exclude_patterns",
+        nargs="*",
+        metavar="PATTERN",
+        help=configuration.EXCLUDE_PATTERNS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--ignore-file-name",
+        action="store",
+        metavar="NAME",
+        help=configuration.IGNORE_FILE_NAME_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--streaming-merge",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.STREAMING_MERGE_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--progress",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.PROGRESS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--print-file-tree",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.PRINT_FILE_TREE_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--profile",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.PROFILE_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--append",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.APPEND_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--skip-unchanged",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.SKIP_UNCHANGED_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--fingerprint-contents",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.FINGERPRINT_CONTENTS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--memory-budget",
+        action="store",
+        type=int,
+        metavar="MEGABYTES",
+        help=configuration.MEMORY_BUDGET_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--prefetch-files",
+        action="store",
+        type=int,
+        help=configuration.PREFETCH_FILES_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--prefetch-memory",
+        action="store",
+        type=int,
+        metavar="MEGABYTES",
+        help=configuration.PREFETCH_MEMORY_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--compact-output",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.COMPACT_OUTPUT_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        help=configuration.JOBS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--split-pages",
+        action="store",
+        type=int,
+        metavar="PAGES",
+        help=configuration.SPLIT_PAGES_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--split-size",
+        action="store",
+        type=int,
+        metavar="MEGABYTES",
+        help=configuration.SPLIT_SIZE_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--batch-workers",
+        action="store",
+        type=int,
+        help=configuration.BATCH_WORKERS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--server-port",
+        action="store",
+        type=int,
+        metavar="PORT",
+        help=configuration.SERVER_PORT_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--server-queue-size",
+        action="store",
+        type=int,
+        help=configuration.SERVER_QUEUE_SIZE_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--server-token",
+        action="store",
+        metavar="TOKEN",
+        help=configuration.SERVER_TOKEN_DESCRIPTION,
+    )
     parameters_args.add_argument(
         "-p",
         "--image-page-fallback-size",
@@ -116,6 +285,26 @@ def parse_arguments(help_override: bool = False):
         help=configuration.IMAGE_PAGE_FALLBACK_SIZE_DESCRIPTION,
     )
     parameters_args.add_argument("-m", "--margin", action="store", help=configuration.MARGIN_DESCRIPTION)
+    parameters_args.add_argument(
+        "--image-workers",
+        action="store",
+        type=int,
+        help=configuration.IMAGE_WORKERS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--max-image-dpi",
+        action="store",
+        type=int,
+        metavar="DPI",
+        help=configuration.MAX_IMAGE_DPI_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--image-quality",
+        action="store",
+        type=int,
+        metavar="QUALITY",
+        help=configuration.IMAGE_QUALITY_DESCRIPTION,
+    )
     parameters_args.add_argument(
         "--fp",
         "--force-image-page-fallback-size",
@@ -144,6 +333,29 @@ def parse_arguments(help_override: bool = False):
         nargs="*",
         help=configuration.LIBREOFFICE_PATH_DESCRIPTION,
     )
+    parameters_args.add_argument(
+        "--libreoffice-workers",
+        action="store",
+        type=int,
+        help=configuration.LIBREOFFICE_WORKERS_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--libreoffice-server",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.LIBREOFFICE_SERVER_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--libreoffice-keep-running",
+        action=argparse.BooleanOptionalAction,
+        help=configuration.LIBREOFFICE_KEEP_RUNNING_DESCRIPTION,
+    )
+    parameters_args.add_argument(
+        "--conversion-cache-size",
+        action="store",
+        type=int,
+        metavar="MEGABYTES",
+        help=configuration.CONVERSION_CACHE_SIZE_DESCRIPTION,
+    )
     # OUTPUT ARGS
     output_args = parser.add_argument_group(
         "Output",
@@ -168,10 +380,12 @@ def parse_arguments(help_override: bool = False):
         help="Path of the output file. Relative to the current working directory. "
         'Extension will be changed to ".pdf/.png" as needed.',
     )
+    # a formatter is created for every added argument too, so the rich one is set only after all were added
+    parser.formatter_class = rich_help_formatter
     args = parser.parse_args()
     if args.whatif:
         args.quiet = False
-    if not args.files or help_override:
+    if not (args.files or args.batch or args.serve) or help_override:
         parser.print_help()
         sys.exit()
     set_quiet(args.quiet)
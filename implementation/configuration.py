@@ -1,14 +1,15 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+from functools import cache
 import os
 from pathlib import Path
-from typing import Sequence
-from tomlkit import TOMLDocument, comment, document, nl, item, dump, load, register_encoder
-import pymupdf
+from typing import TYPE_CHECKING, Sequence
 from .logger import printlog
-from .dimension import Dimension
+from .dimension import Dimension, paper_size
 
-# register fallback string encoder. Dimension can be parsed to and from string
-register_encoder(lambda x: item(str(x)))
+# tomlkit and pymupdf take a while to import and are not needed e.g. to print help,
+# so they are imported only where they are used
+if TYPE_CHECKING:
+    from tomlkit import TOMLDocument
 
 PATH_DISCLAIMER = [
     "Paths may contain '~' and environmental variables (surrounded with '%%' or prepended with '$').",
@@ -81,6 +82,237 @@ QUIET_DESCRIPTION = "If True, prints no messages to the console. Overrides --con
 
 RECURSION_DESCRIPTION = "How deep to search for supported files in a directory."
 
+PATTERN_DISCLAIMER = [
+    "Patterns use '*', '?' and '[]' wildcards and ignore letter case. "
+    "A pattern without a slash is matched against the name of the file or directory, "
+    "a pattern with a slash against its path relative to the searched directory. "
+    "A pattern ending with a slash matches only directories.",
+]
+
+INCLUDE_PATTERNS_DESCRIPTION = " \n".join(
+    [
+        "If not empty, only files matching at least one of these patterns are merged from searched directories.",
+        "Files given directly as input are always merged.",
+    ]
+    + PATTERN_DISCLAIMER
+)
+
+EXCLUDE_PATTERNS_DESCRIPTION = " \n".join(
+    [
+        "Files and directories matching any of these patterns are skipped when searching directories. "
+        "Skipped directories are not searched at all.",
+    ]
+    + PATTERN_DISCLAIMER
+)
+
+IGNORE_FILE_NAME_DESCRIPTION = " \n".join(
+    [
+        "Name of ignore files. If a searched directory contains a file with this name, "
+        "each of its lines is used as an exclude pattern for that directory and its subdirectories "
+        "(relative to that directory). Empty lines and lines starting with '#' are skipped.",
+        "An empty string disables ignore files.",
+    ]
+)
+
+STREAMING_MERGE_DESCRIPTION = " \n".join(
+    [
+        "If True, files are merged as soon as they are found, while directories are still being searched, "
+        "instead of searching all directories first.",
+        "The tree of found files is not printed and jobs is ignored. "
+        "Image pages get the size of the first PDF found before the first image.",
+    ]
+)
+
+PROGRESS_DESCRIPTION = " \n".join(
+    [
+        "If True, a single status line with the number of merged files and pages, the throughput "
+        "and the estimated time left is shown, instead of a message for every merged file.",
+    ]
+)
+
+PRINT_FILE_TREE_DESCRIPTION = " \n".join(
+    [
+        "If True, the tree of found files is printed before merging.",
+        "Printing very large trees can take a while on some consoles.",
+    ]
+)
+
+PROFILE_DESCRIPTION = " \n".join(
+    [
+        "If True, wall time, CPU time, bytes read and written and peak memory are recorded for every stage "
+        "of the merge and every merged file.",
+        "A summary with the slowest files is printed and the full report is saved as JSON next to the output "
+        "(OUTPUT_NAME.profile.json).",
+    ]
+)
+
+APPEND_DESCRIPTION = " \n".join(
+    [
+        "If True and the output file exists, only files that are not in it yet are merged, "
+        "and they are added at the end of it (only the changes are written).",
+        "Merged files are listed in a file next to the output (OUTPUT_NAME.merged.json). "
+        "If that list is missing or does not match the output, all files are merged again.",
+        "Makes sense only with a fixed output file (--output-file).",
+    ]
+)
+
+SKIP_UNCHANGED_DESCRIPTION = " \n".join(
+    [
+        "If True, nothing is merged when the output file exists and was merged from the same files "
+        "(same paths, order, sizes and modification times) with the same settings. Use --force to merge anyway.",
+        "The files and settings are recorded in a file next to the output (OUTPUT_NAME.merged.json).",
+        "Makes sense only with a fixed output file (--output-file). With streaming_merge all directories are "
+        "searched before merging.",
+    ]
+)
+
+FINGERPRINT_CONTENTS_DESCRIPTION = " \n".join(
+    [
+        "If True, skip_unchanged compares contents of the files instead of their modification times, "
+        "so files that were only touched or copied again do not cause a merge.",
+        "Every file has to be read for that.",
+    ]
+)
+
+LIBREOFFICE_WORKERS_DESCRIPTION = " \n".join(
+    [
+        "How many LibreOffice processes can convert documents at the same time.",
+        "Each process uses its own temporary LibreOffice profile.",
+        "0 or less means one process per processor core.",
+    ]
+)
+
+LIBREOFFICE_SERVER_DESCRIPTION = " \n".join(
+    [
+        "If True, LibreOffice is started once per worker and kept running in the background for the whole run, "
+        "instead of being started for every document.",
+        "If it cannot be started, documents are converted by starting LibreOffice for every document.",
+    ]
+)
+
+IMAGE_WORKERS_DESCRIPTION = " \n".join(
+    [
+        "How many processes can prepare images at the same time. Pages are still added in the original order.",
+        "0 or less means one process per processor core.",
+    ]
+)
+
+MAX_IMAGE_DPI_DESCRIPTION = " \n".join(
+    [
+        "Images with a higher resolution than this (after being fitted on the page) are downsampled "
+        "(unless it would make them bigger). JPEG images stay JPEG.",
+        "0 keeps original resolution.",
+    ]
+)
+
+IMAGE_QUALITY_DESCRIPTION = " \n".join(
+    [
+        "If between 1 and 100, images are recompressed as JPEG with this quality "
+        "(unless it would make them bigger or they have transparency).",
+        "0 keeps original image data.",
+    ]
+)
+
+MEMORY_BUDGET_DESCRIPTION = " \n".join(
+    [
+        "Approximate amount of memory (in megabytes) the merged pages can take before they are written to disk.",
+        "The output is then written in parts, so memory use does not grow with the size of the merge.",
+        "0 keeps everything in memory until the output is saved.",
+    ]
+)
+
+PREFETCH_FILES_DESCRIPTION = " \n".join(
+    [
+        "How many PDFs (also converted documents) are read into memory ahead of being merged, "
+        "so that reading them from disk overlaps with merging earlier files.",
+        "0 reads every file only when it is merged.",
+    ]
+)
+
+PREFETCH_MEMORY_DESCRIPTION = " \n".join(
+    [
+        "Approximate amount of memory (in megabytes) the PDFs read ahead can take. "
+        "A larger file is still read ahead, but alone.",
+    ]
+)
+
+COMPACT_OUTPUT_DESCRIPTION = " \n".join(
+    [
+        "If True, identical objects (like fonts and images repeated in many files) are stored only once, "
+        "unused objects are removed and all streams are compressed when saving the output.",
+        "Makes the output smaller, but saving takes longer.",
+    ]
+)
+
+SPLIT_PAGES_DESCRIPTION = " \n".join(
+    [
+        "If more than 0, the output is split into parts of at most this many pages, "
+        "saved as NAME_001.pdf, NAME_002.pdf ... next to the output.",
+        "Parts are merged and saved by as many processes as jobs, at the same time. append and skip_unchanged are not used.",
+    ]
+)
+
+SPLIT_SIZE_DESCRIPTION = " \n".join(
+    [
+        "If more than 0, the output is split into parts of about this many megabytes (like with split_pages). "
+        "The size is estimated from the size of the merged files, so a part can end up somewhat larger or smaller.",
+        "A single page larger than this gets a part of its own.",
+    ]
+)
+
+JOBS_DESCRIPTION = " \n".join(
+    [
+        "How many processes merge files at the same time. "
+        "Files are split into consecutive parts, each part is merged by one process and the parts are joined "
+        "in order at the end.",
+        "1 merges all files in one process. 0 or less means one process per processor core.",
+    ]
+)
+
+BATCH_WORKERS_DESCRIPTION = " \n".join(
+    [
+        "How many jobs of a batch file (--batch) or of the merge server (--serve) are merged at the same time, "
+        "each in its own process.",
+        "Messages of the jobs are not printed then, only the summary. "
+        "1 merges the jobs one after another. 0 or less means one process per processor core.",
+    ]
+)
+
+SERVER_PORT_DESCRIPTION = " \n".join(
+    [
+        "Port on which the merge server (--serve) listens. It accepts connections only from this computer.",
+        "0 picks a free port.",
+    ]
+)
+
+SERVER_QUEUE_SIZE_DESCRIPTION = " \n".join(
+    [
+        "How many jobs can wait or run in the merge server at once. Further jobs are rejected until some finish.",
+    ]
+)
+
+SERVER_TOKEN_DESCRIPTION = " \n".join(
+    [
+        "If not empty, the merge server accepts only requests with the header 'Authorization: Bearer TOKEN'.",
+        "Use it if other users of this computer should not be able to send jobs.",
+    ]
+)
+
+CONVERSION_CACHE_SIZE_DESCRIPTION = " \n".join(
+    [
+        "Maximum size (in megabytes) of the cache of converted office documents.",
+        "Documents are recognized by their contents, so a document that did not change is not converted again.",
+        "When the cache is full, least recently used files are removed. 0 disables the cache.",
+    ]
+)
+
+LIBREOFFICE_KEEP_RUNNING_DESCRIPTION = " \n".join(
+    [
+        "If True, background LibreOffice instances (see libreoffice_server) are not closed when the program exits "
+        "and will be reused by the next run.",
+    ]
+)
+
 
 def expand_path(path: str | Path):
     str_path = os.path.expandvars(str(path))
@@ -88,14 +320,62 @@ def expand_path(path: str | Path):
     return str_path
 
 
-def add_comment(doc: TOMLDocument, item_comment):
+@cache
+def register_toml_encoder():
+    # pylint: disable=import-outside-toplevel
+    from tomlkit import item, register_encoder
+
+    # register fallback string encoder. Dimension can be parsed to and from string
+    register_encoder(lambda x: item(str(x)))
+
+
+def add_comment(doc: "TOMLDocument", item_comment):
+    from tomlkit import comment  # pylint: disable=import-outside-toplevel
+
     doc.add(comment(str(item_comment)))
 
 
-def newline(doc: TOMLDocument):
+def newline(doc: "TOMLDocument"):
+    from tomlkit import nl  # pylint: disable=import-outside-toplevel
+
     doc.add(nl())
 
 
+# allowed ranges (inclusive) of integer values, None means no limit; other integers can have any value
+INTEGER_RANGES: dict[str, tuple[int | None, int | None]] = {
+    "recursion_limit": (0, None),
+    "conversion_cache_size": (0, None),
+    "max_image_dpi": (0, None),
+    "image_quality": (0, 100),
+    "memory_budget": (0, None),
+    "prefetch_files": (0, None),
+    "prefetch_memory": (0, None),
+    "split_pages": (0, None),
+    "split_size": (0, None),
+    "server_port": (0, 65535),
+    "server_queue_size": (1, None),
+}
+
+
+def check_value(name: str, value_type: type, value):
+    """Raises ValueError naming the setting if the value does not have the type of the setting
+    (or is out of its INTEGER_RANGES).
+    """
+    if value_type is bool and not isinstance(value, bool):
+        raise ValueError(f"{name} = {value!r} (not true or false)")
+    if value_type is int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{name} = {value!r} (not a whole number)")
+        low, high = INTEGER_RANGES.get(name, (None, None))
+        if (low is not None and value < low) or (high is not None and value > high):
+            allowed = f"{low} to {high}" if high is not None else f"{low} or more"
+            raise ValueError(f"{name} = {value!r} (allowed {allowed})")
+    if value_type is str and not isinstance(value, str):
+        raise ValueError(f"{name} = {value!r} (not a string)")
+    if value_type == list[str] and not (isinstance(value, list) and all(isinstance(x, str) for x in value)):
+        raise ValueError(f"{name} = {value!r} (not a list of strings)")
+
+
 @dataclass
 class Configuration:
     # pylint: disable=too-many-instance-attributes
@@ -114,10 +394,40 @@ class Configuration:
     confirm_exit: bool = False
     quiet: bool = False
     recursion_limit: int = 5
+    include_patterns: list[str] = field(default_factory=list)
+    exclude_patterns: list[str] = field(default_factory=list)
+    ignore_file_name: str = ".mergeignore"
+    streaming_merge: bool = False
+    progress: bool = False
+    print_file_tree: bool = True
+    profile: bool = False
+    append: bool = False
+    skip_unchanged: bool = False
+    fingerprint_contents: bool = False
+    libreoffice_workers: int = 0
+    libreoffice_server: bool = False
+    libreoffice_keep_running: bool = False
+    conversion_cache_size: int = 500
+    image_workers: int = 0
+    max_image_dpi: int = 0
+    image_quality: int = 0
+    memory_budget: int = 0
+    prefetch_files: int = 8
+    prefetch_memory: int = 256
+    compact_output: bool = False
+    jobs: int = 1
+    split_pages: int = 0
+    split_size: int = 0
+    batch_workers: int = 1
+    server_port: int = 8765
+    server_queue_size: int = 100
+    server_token: str = ""
     whatif: bool = False
     language: str = ""
 
-    def add_item(self, doc: TOMLDocument, key: str, description: list[str] | str):
+    def add_item(self, doc: "TOMLDocument", key: str, description: list[str] | str):
+        from tomlkit import item  # pylint: disable=import-outside-toplevel
+
         newline(doc)
         if isinstance(description, list):
             description = "\n".join(description)
@@ -134,7 +444,7 @@ class Configuration:
         if value is not None:
             setattr(self, var_name, value)
 
-    def _set_from_dictlike(self, var_name: str, dictlike: dict | TOMLDocument):
+    def _set_from_dictlike(self, var_name: str, dictlike: "dict | TOMLDocument"):
         """
         Finds value by key in the dictlike and tries to set the property of the same to that value,
         If dictlike does not have this key, does nothing.
@@ -161,8 +471,8 @@ class Configuration:
         if isinstance(self._image_page_fallback_size, Dimension):
             return self._image_page_fallback_size
         if isinstance(self._image_page_fallback_size, str):
-            p_size = pymupdf.paper_size(self._image_page_fallback_size)
-            if p_size != (-1, -1):
+            p_size = paper_size(self._image_page_fallback_size)
+            if p_size is not None:
                 return Dimension(p_size[0], p_size[1], "pt")
             return Dimension.from_str(self._image_page_fallback_size)
         raise ValueError()
@@ -207,7 +517,33 @@ class Configuration:
         if value:
             self._output_directory = str(value)
 
+    def resolve(self, base_path: Path) -> "Settings":
+        """Checks all values and resolves them once: parses dimensions and paper sizes, looks for LibreOffice
+        and expands the output directory (relative to `base_path`).
+        Raises ValueError naming the first invalid value.
+        """
+        for x in fields(self):
+            check_value(x.name.lstrip("_"), x.type, getattr(self, x.name))
+        resolved: dict = {}
+        for name in ("margin", "image_page_fallback_size"):
+            try:
+                resolved[name] = getattr(self, name)
+            except (ValueError, IndexError) as e:
+                raise ValueError(f"{name} = '{getattr(self, '_' + name)}' ({e})") from e
+        resolved["libreoffice_path"] = self.libreoffice_path
+        resolved["output_directory"] = self.output_directory_expanded(base_path)
+        resolved["include_patterns"] = tuple(self.include_patterns)
+        resolved["exclude_patterns"] = tuple(self.exclude_patterns)
+        for x in fields(self):
+            if not x.name.startswith("_") and x.name not in resolved:
+                resolved[x.name] = getattr(self, x.name)
+        return Settings(**resolved)
+
     def save_config(self, destination: str | Path):
+        # pylint: disable=import-outside-toplevel
+        from tomlkit import document, dump
+
+        register_toml_encoder()
         doc = document()
         add_comment(doc, "Configuration file for stitcher")
 
@@ -216,10 +552,17 @@ class Configuration:
             "_libreoffice_path",
             LIBREOFFICE_PATH_DESCRIPTION,
         )
+        self.add_item(doc, "libreoffice_workers", LIBREOFFICE_WORKERS_DESCRIPTION)
+        self.add_item(doc, "libreoffice_server", LIBREOFFICE_SERVER_DESCRIPTION)
+        self.add_item(doc, "libreoffice_keep_running", LIBREOFFICE_KEEP_RUNNING_DESCRIPTION)
+        self.add_item(doc, "conversion_cache_size", CONVERSION_CACHE_SIZE_DESCRIPTION)
         self.add_item(doc, "language", LANGUAGE_DESCRIPTION)
         self.add_item(doc, "_output_directory", ["Path to the output folder."] + PATH_DISCLAIMER)
         self.add_item(doc, "_margin", MARGIN_DESCRIPTION)
         self.add_item(doc, "_image_page_fallback_size", IMAGE_PAGE_FALLBACK_SIZE_DESCRIPTION)
+        self.add_item(doc, "image_workers", IMAGE_WORKERS_DESCRIPTION)
+        self.add_item(doc, "max_image_dpi", MAX_IMAGE_DPI_DESCRIPTION)
+        self.add_item(doc, "image_quality", IMAGE_QUALITY_DESCRIPTION)
         self.add_item(
             doc,
             "force_image_page_fallback_size",
@@ -229,6 +572,27 @@ class Configuration:
         self.add_item(doc, "confirm_exit", CONFIRM_EXIT_DESCRIPTION)
         self.add_item(doc, "quiet", QUIET_DESCRIPTION)
         self.add_item(doc, "recursion_limit", RECURSION_DESCRIPTION)
+        self.add_item(doc, "include_patterns", INCLUDE_PATTERNS_DESCRIPTION)
+        self.add_item(doc, "exclude_patterns", EXCLUDE_PATTERNS_DESCRIPTION)
+        self.add_item(doc, "ignore_file_name", IGNORE_FILE_NAME_DESCRIPTION)
+        self.add_item(doc, "streaming_merge", STREAMING_MERGE_DESCRIPTION)
+        self.add_item(doc, "progress", PROGRESS_DESCRIPTION)
+        self.add_item(doc, "print_file_tree", PRINT_FILE_TREE_DESCRIPTION)
+        self.add_item(doc, "profile", PROFILE_DESCRIPTION)
+        self.add_item(doc, "append", APPEND_DESCRIPTION)
+        self.add_item(doc, "skip_unchanged", SKIP_UNCHANGED_DESCRIPTION)
+        self.add_item(doc, "fingerprint_contents", FINGERPRINT_CONTENTS_DESCRIPTION)
+        self.add_item(doc, "memory_budget", MEMORY_BUDGET_DESCRIPTION)
+        self.add_item(doc, "prefetch_files", PREFETCH_FILES_DESCRIPTION)
+        self.add_item(doc, "prefetch_memory", PREFETCH_MEMORY_DESCRIPTION)
+        self.add_item(doc, "compact_output", COMPACT_OUTPUT_DESCRIPTION)
+        self.add_item(doc, "jobs", JOBS_DESCRIPTION)
+        self.add_item(doc, "split_pages", SPLIT_PAGES_DESCRIPTION)
+        self.add_item(doc, "split_size", SPLIT_SIZE_DESCRIPTION)
+        self.add_item(doc, "batch_workers", BATCH_WORKERS_DESCRIPTION)
+        self.add_item(doc, "server_port", SERVER_PORT_DESCRIPTION)
+        self.add_item(doc, "server_queue_size", SERVER_QUEUE_SIZE_DESCRIPTION)
+        self.add_item(doc, "server_token", SERVER_TOKEN_DESCRIPTION)
         with open(str(destination), "w", encoding="utf8") as fp:
             dump(doc, fp)
         printlog("ConfigSaved", destination)
@@ -240,21 +604,114 @@ class Configuration:
         Args:
             path (Path | str): Path to the TOML file.
         """
+        from tomlkit import load  # pylint: disable=import-outside-toplevel
+
         with open(path, "r", encoding="utf8") as fp:
             doc = load(fp)
             self.update_from_dictlike(doc)
 
-    def update_from_dictlike(self, dictionary: dict | TOMLDocument):
+    def update_from_dictlike(self, dictionary: "dict | TOMLDocument"):
         self._set_from_dictlike("_margin", dictionary)
         self._set_from_dictlike("_image_page_fallback_size", dictionary)
         self._set_from_dictlike("force_image_page_fallback_size", dictionary)
+        self._set_from_dictlike("image_workers", dictionary)
+        self._set_from_dictlike("max_image_dpi", dictionary)
+        self._set_from_dictlike("image_quality", dictionary)
         self._set_from_dictlike("output_directory", dictionary)
         self._set_from_dictlike("libreoffice_path", dictionary)
+        self._set_from_dictlike("libreoffice_workers", dictionary)
+        self._set_from_dictlike("libreoffice_server", dictionary)
+        self._set_from_dictlike("libreoffice_keep_running", dictionary)
+        self._set_from_dictlike("conversion_cache_size", dictionary)
         self._set_from_dictlike("alphabetic_file_sorting", dictionary)
         self._set_from_dictlike("confirm_exit", dictionary)
         self._set_from_dictlike("quiet", dictionary)
         self._set_from_dictlike("recursion_limit", dictionary)
+        self._set_from_dictlike("include_patterns", dictionary)
+        self._set_from_dictlike("exclude_patterns", dictionary)
+        self._set_from_dictlike("ignore_file_name", dictionary)
+        self._set_from_dictlike("streaming_merge", dictionary)
+        self._set_from_dictlike("progress", dictionary)
+        self._set_from_dictlike("print_file_tree", dictionary)
+        self._set_from_dictlike("profile", dictionary)
+        self._set_from_dictlike("append", dictionary)
+        self._set_from_dictlike("skip_unchanged", dictionary)
+        self._set_from_dictlike("fingerprint_contents", dictionary)
+        self._set_from_dictlike("memory_budget", dictionary)
+        self._set_from_dictlike("prefetch_files", dictionary)
+        self._set_from_dictlike("prefetch_memory", dictionary)
+        self._set_from_dictlike("compact_output", dictionary)
+        self._set_from_dictlike("jobs", dictionary)
+        self._set_from_dictlike("split_pages", dictionary)
+        self._set_from_dictlike("split_size", dictionary)
+        self._set_from_dictlike("batch_workers", dictionary)
+        self._set_from_dictlike("server_port", dictionary)
+        self._set_from_dictlike("server_queue_size", dictionary)
+        self._set_from_dictlike("server_token", dictionary)
         self._set_from_dictlike("language", dictionary)
         if isinstance(dictionary, dict):
             # whatif should not be read from TOML
             self._set_from_dictlike("whatif", dictionary)
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Configuration with all values checked and resolved (see Configuration.resolve).
+    Cannot be changed, so the merge and all jobs of a batch or of the server can share it.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    output_directory: Path
+    libreoffice_path: Path | None
+    """Path of the first LibreOffice executable that exists, None if there is none."""
+    margin: Dimension
+    image_page_fallback_size: Dimension
+    force_image_page_fallback_size: bool
+    alphabetic_file_sorting: bool
+    confirm_exit: bool
+    quiet: bool
+    recursion_limit: int
+    include_patterns: tuple[str, ...]
+    exclude_patterns: tuple[str, ...]
+    ignore_file_name: str
+    streaming_merge: bool
+    progress: bool
+    print_file_tree: bool
+    profile: bool
+    append: bool
+    skip_unchanged: bool
+    fingerprint_contents: bool
+    libreoffice_workers: int
+    libreoffice_server: bool
+    libreoffice_keep_running: bool
+    conversion_cache_size: int
+    image_workers: int
+    max_image_dpi: int
+    image_quality: int
+    memory_budget: int
+    prefetch_files: int
+    prefetch_memory: int
+    compact_output: bool
+    jobs: int
+    split_pages: int
+    split_size: int
+    batch_workers: int
+    server_port: int
+    server_queue_size: int
+    server_token: str
+    whatif: bool
+    language: str
+
+    def output_settings(self) -> dict:
+        """Returns values of the settings which change the merged output (for the same input files)."""
+        return {
+            "margin": str(self.margin),
+            "image_page_fallback_size": str(self.image_page_fallback_size),
+            "force_image_page_fallback_size": self.force_image_page_fallback_size,
+            "max_image_dpi": self.max_image_dpi,
+            "image_quality": self.image_quality,
+            "compact_output": self.compact_output,
+            "split_pages": self.split_pages,
+            "split_size": self.split_size,
+            "libreoffice": self.libreoffice_path is not None,
+        }
@@ -1,11 +1,39 @@
 import re
-from typing import Sequence
-import pymupdf
+from typing import TYPE_CHECKING, Sequence
+
+if TYPE_CHECKING:
+    import pymupdf
 
 
 PT_BY_INCH = 72
 PT_BY_CM = PT_BY_INCH / 2.54
 PT_BY_MM = PT_BY_INCH / 25.4
+# fmt: off
+# same as pymupdf.paper_sizes(), kept here so that resolving the configuration does not import pymupdf
+PAPER_SIZES = {
+    "a0": (2384, 3370), "a1": (1684, 2384), "a2": (1191, 1684), "a3": (842, 1191), "a4": (595, 842),
+    "a5": (420, 595), "a6": (298, 420), "a7": (210, 298), "a8": (147, 210), "a9": (105, 147), "a10": (74, 105),
+    "b0": (2835, 4008), "b1": (2004, 2835), "b2": (1417, 2004), "b3": (1001, 1417), "b4": (709, 1001),
+    "b5": (499, 709), "b6": (354, 499), "b7": (249, 354), "b8": (176, 249), "b9": (125, 176), "b10": (88, 125),
+    "c0": (2599, 3677), "c1": (1837, 2599), "c2": (1298, 1837), "c3": (918, 1298), "c4": (649, 918),
+    "c5": (459, 649), "c6": (323, 459), "c7": (230, 323), "c8": (162, 230), "c9": (113, 162), "c10": (79, 113),
+    "card-4x6": (288, 432), "card-5x7": (360, 504), "commercial": (297, 684), "executive": (522, 756),
+    "invoice": (396, 612), "ledger": (792, 1224), "legal": (612, 1008), "legal-13": (612, 936),
+    "letter": (612, 792), "monarch": (279, 540), "tabloid-extra": (864, 1296),
+}
+# fmt: on
+
+
+def paper_size(name: str) -> tuple[int, int] | None:
+    """Returns (width, height) in points of a paper format like 'A4', or 'A4-L' for landscape. None if unknown."""
+    size = name.lower()
+    landscape = size.endswith("-l")
+    if landscape or size.endswith("-p"):
+        size = size[:-2]
+    if size not in PAPER_SIZES:
+        return None
+    width, height = PAPER_SIZES[size]
+    return (height, width) if landscape else (width, height)
 
 
 def get_value_unit(s: str):
@@ -38,7 +66,9 @@ class Dimension:
         self.vertical = (vertical or horizontal) * unit_mult
 
     @property
-    def rect(self) -> pymupdf.Rect:
+    def rect(self) -> "pymupdf.Rect":
+        import pymupdf  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
         return pymupdf.Rect(x0=0, y0=0, x1=self.horizontal, y1=self.vertical)
 
     @classmethod
@@ -122,6 +152,8 @@ def _try_to_convert_to_dimension(o):
         if len(o) > 3:
             return Dimension(o[3], o[4], "pt")
         raise ValueError(f"Cannot {o} convert to Dimension")
+    import pymupdf  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
     if isinstance(o, pymupdf.Rect):
         return Dimension(o.width, o.height, "pt")
     raise ValueError(f"Cannot {o} convert to Dimension")
@@ -1,8 +1,10 @@
 import datetime
+import os
+from fnmatch import fnmatchcase
 from pathlib import Path
-from typing import Any, Generator
+from typing import Any, Generator, Iterable
 from natsort import natsorted, ns
-from .logger import get_quiet, printline, printlog
+from .logger import printline, printlines, printlog
 
 # fmt: off
 # extensions copy-pasted from Open File windows in LibreOffice
@@ -90,78 +92,246 @@ def get_branch(root: bool = False):
     return ROOT_BRANCH if root else BRANCH
 
 
+FILE_COLOR = "\033[32m{0}\033[0m"
+
+
+class ScanPattern:
+    """A single include or exclude pattern. `base` is the path (relative to the searched directory)
+    of the directory the pattern was defined for, with a trailing slash.
+    """
+
+    __slots__ = ("pattern", "base", "directory_only", "match_path")
+
+    def __init__(self, pattern: str, base: str = "") -> None:
+        pattern = pattern.strip().replace("\\", "/").casefold()
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.strip("/")
+        self.pattern = pattern
+        self.base = base
+        self.match_path = "/" in pattern
+
+    def matches(self, relative_path: str, name: str, is_dir: bool) -> bool:
+        if self.directory_only and not is_dir:
+            return False
+        if not self.match_path:
+            return fnmatchcase(name.casefold(), self.pattern)
+        if not relative_path.startswith(self.base):
+            return False
+        return fnmatchcase(relative_path[len(self.base) :].casefold(), self.pattern)
+
+
+def read_ignore_file(path: Path) -> list[str]:
+    try:
+        with open(path, "r", encoding="utf8") as fp:
+            lines = [line.strip() for line in fp]
+    except (OSError, ValueError):
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+class ScanFilter:
+    """Decides which entries of a searched directory are kept, so that skipped directories are never listed.
+
+    Every directory gets its own filter (see `enter`), which knows the directory's path relative to the searched
+    directory and the patterns read from ignore files of the directory and its parents.
+    Only files with supported extensions are kept.
+    """
+
+    __slots__ = ("include", "exclude", "ignore_file_name", "relative")
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = (), ignore_file_name: str = "") -> None:
+        self.include = [ScanPattern(p) for p in include if p.strip()]
+        self.exclude = [ScanPattern(p) for p in exclude if p.strip()]
+        self.ignore_file_name = ignore_file_name
+        self.relative = ""
+
+    def _copy(self, relative: str) -> "ScanFilter":
+        child = ScanFilter(ignore_file_name=self.ignore_file_name)
+        child.include = self.include
+        child.exclude = self.exclude
+        child.relative = relative
+        return child
+
+    def with_ignore_file(self, directory: Path, file_names: list[str]) -> "ScanFilter":
+        """Returns the filter extended with patterns of the ignore file of the directory, if there is one."""
+        if not self.ignore_file_name or self.ignore_file_name not in file_names:
+            return self
+        patterns = read_ignore_file(directory.joinpath(self.ignore_file_name))
+        if not patterns:
+            return self
+        extended = self._copy(self.relative)
+        extended.exclude = self.exclude + [ScanPattern(p, self.relative) for p in patterns]
+        return extended
+
+    def enter(self, directory_name: str) -> "ScanFilter":
+        """Returns the filter for a subdirectory."""
+        return self._copy(f"{self.relative}{directory_name}/")
+
+    def keeps_file(self, name: str) -> bool:
+        if os.path.splitext(name)[1].casefold() not in all_formats:
+            return False
+        relative_path = self.relative + name
+        if self.include and not any(p.matches(relative_path, name, False) for p in self.include):
+            return False
+        return not any(p.matches(relative_path, name, False) for p in self.exclude)
+
+    def keeps_directory(self, name: str) -> bool:
+        relative_path = self.relative + name
+        return not any(p.matches(relative_path, name, True) for p in self.exclude)
+
+
+def get_tree_prefix(depth: list[bool]) -> str:
+    return "".join((get_branch(i == 0) if d else NO_BRANCH) for i, d in enumerate(depth))
+
+
+def scan_directory(path: Path, scan_filter: ScanFilter) -> tuple[list[str], list[str], ScanFilter] | None:
+    """Returns names of kept files and subdirectories of the directory, each group in natural order,
+    together with the filter for its entries. Returns None if the path is not a directory or cannot be read.
+    """
+    file_names: list[str] = []
+    directory_names: list[str] = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                (directory_names if entry.is_dir() else file_names).append(entry.name)
+    except OSError:  # not a directory, does not exist or cannot be read
+        return None
+    scan_filter = scan_filter.with_ignore_file(path, file_names)
+    return (
+        natsorted(filter(scan_filter.keeps_file, file_names), alg=ns.IGNORECASE),
+        natsorted(filter(scan_filter.keeps_directory, directory_names), alg=ns.IGNORECASE),
+        scan_filter,
+    )
+
+
 class FoldedPath:
+    """Directory tree of a single input path.
 
-    def __init__(self, path: Path | str, is_last: bool) -> None:
-        self.path = Path(path)
-        self.subpaths: list[FoldedPath] = []
-        self.is_last = is_last
+    Only directories have their own nodes. Files are stored as names in their directory's node,
+    which keeps the tree small for directories with many files. Directory listings come from os.scandir,
+    so the type of each entry is known without additional stat calls.
+    """
+
+    __slots__ = ("path", "files", "directories", "_is_dir")
 
-    def populate(self, current_depth: int, max_depth: int):
-        if not self.path.is_dir():
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self.files: list[str] = []
+        self.directories: list[FoldedPath] = []
+        self._is_dir = False
+
+    def populate(self, current_depth: int, max_depth: int, scan_filter: ScanFilter | None = None):
+        listing = scan_directory(self.path, scan_filter or ScanFilter())
+        if listing is None:
+            self._is_dir = self.path.is_dir()
             return
-        sorted_entries = sorted(
-            natsorted(self.path.glob("*"), alg=ns.IGNORECASE), key=lambda x: x.is_dir(), reverse=False
-        )
+        self._is_dir = True
+        self.files, directory_names, scan_filter = listing
         if current_depth + 1 >= max_depth:
-            sorted_entries = [s for s in sorted_entries if not s.is_dir()]
-        sorted_count = len(sorted_entries)
-        for i, entry in enumerate(sorted_entries):
-            if entry.is_dir() and current_depth + 1 >= max_depth:
-                continue
-            self.subpaths.append(FoldedPath(entry, i + 1 == sorted_count))
-            self.subpaths[-1].populate(current_depth + 1, max_depth)
+            return
+        for name in directory_names:
+            self.directories.append(FoldedPath(self.path.joinpath(name)))
+            self.directories[-1].populate(current_depth + 1, max_depth, scan_filter.enter(name))
 
     def display_form(self, is_root: bool):
-        # junction = get_junction(is_root) if self.is_dir() else ""
-        junction = ""
-        if not self.is_dir():
-            color = "\033[32m{0}\033[0m"
-        else:
-            color = "{0}"
         name = str(self.path.absolute()) if is_root else self.path.name
-        return junction + color.format(name)
+        return name if self.is_dir() else FILE_COLOR.format(name)
 
     def is_dir(self):
-        return self.path.is_dir()
+        return self._is_dir
 
     def __repr__(self):
-        return f"{self.path} - {len(self.subpaths)}"
-
-    def print(self, is_root: bool = True, depth: list[bool] | None = None):
-        if get_quiet():
-            return
-        line = ""
-        for i, d in enumerate(depth or []):
-            line += get_branch(i == 0) if d else NO_BRANCH
-        line += get_end(is_root) if self.is_last else get_tee(is_root)
-        print(line + self.display_form(is_root))
-        for s in self.subpaths:
-            s.print(False, (depth or []) + [not self.is_last])
-
-    def get_files(self) -> Generator["FoldedPath", Any, None]:
-        for s in self.subpaths:
-            if s.is_dir():
-                yield from s.get_files()
-            else:
-                yield s
-
-
-def recurse_files(paths: list[str], sort_paths: bool, recursion_limit: int):
+        return f"{self.path} - {len(self.files)} files, {len(self.directories)} directories"
+
+    def tree_lines(self, is_last: bool = True, depth: list[bool] | None = None) -> Generator[str, Any, None]:
+        depth = depth or []
+        is_root = not depth
+        yield get_tree_prefix(depth) + (get_end(is_root) if is_last else get_tee(is_root)) + self.display_form(is_root)
+        child_depth = depth + [not is_last]
+        child_prefix = get_tree_prefix(child_depth)
+        child_count = len(self.files) + len(self.directories)
+        for i, name in enumerate(self.files):
+            yield child_prefix + (get_end() if i + 1 == child_count else get_tee()) + FILE_COLOR.format(name)
+        for i, directory in enumerate(self.directories, start=len(self.files)):
+            yield from directory.tree_lines(i + 1 == child_count, child_depth)
+
+    def print(self, is_last: bool = True):
+        printlines(list(self.tree_lines(is_last)))
+
+    def get_files(self) -> Generator[Path, Any, None]:
+        for name in self.files:
+            yield self.path.joinpath(name)
+        for directory in self.directories:
+            yield from directory.get_files()
+
+
+def recurse_files(
+    paths: list[str],
+    sort_paths: bool,
+    recursion_limit: int,
+    scan_filter: ScanFilter | None = None,
+    print_tree: bool = True,
+) -> list[Path]:
+    """Returns supported files from the given paths, in the order they will be merged.
+    If `print_tree` is True, they are also printed as a tree (all at once, when the search is done).
+    Files given directly are always returned, files in directories only if `scan_filter` keeps them.
+    """
     if sort_paths:
         paths = sorted(paths, key=lambda x: x.casefold())
         printlog("InputSorted")
         printline()
-    folded_paths: list[FoldedPath] = []
-    printlog("FilesToProcess")
+    files: list[Path] = []
+    tree_lines: list[str] = []
     for i, path in enumerate(paths):
-        folded_paths.append(FoldedPath(path, i + 1 == len(paths)))
-        folded_paths[-1].populate(0, recursion_limit)
-        folded_paths[-1].print()
-    files = [s.path for f in folded_paths for s in f.get_files()]
+        folded_path = FoldedPath(path)
+        folded_path.populate(0, recursion_limit, scan_filter)
+        if print_tree:
+            tree_lines.extend(folded_path.tree_lines(i + 1 == len(paths)))
+        if folded_path.is_dir():
+            files.extend(folded_path.get_files())
+        elif folded_path.path.is_file():
+            files.append(folded_path.path)
+    if print_tree:
+        printlog("FilesToProcess")
+        printlines(tree_lines)
     return files
 
 
+def walk_files(
+    path: Path, current_depth: int, max_depth: int, scan_filter: ScanFilter
+) -> Generator[Path, Any, None]:
+    """Yields kept files of the directory in the same order as FoldedPath.get_files, without building the tree.
+    Subdirectories are listed only when the files before them have been consumed.
+    """
+    listing = scan_directory(path, scan_filter)
+    if listing is None:
+        return
+    file_names, directory_names, scan_filter = listing
+    for name in file_names:
+        yield path.joinpath(name)
+    if current_depth + 1 >= max_depth:
+        return
+    for name in directory_names:
+        yield from walk_files(path.joinpath(name), current_depth + 1, max_depth, scan_filter.enter(name))
+
+
+def iterate_files(
+    paths: list[str], sort_paths: bool, recursion_limit: int, scan_filter: ScanFilter | None = None
+) -> Generator[Path, Any, None]:
+    """Yields the same files as recurse_files, in the same order, while the directories are being searched.
+    Nothing is printed but the sorting message.
+    """
+    if sort_paths:
+        paths = sorted(paths, key=lambda x: x.casefold())
+        printlog("InputSorted")
+        printline()
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from walk_files(path, 0, recursion_limit, scan_filter or ScanFilter())
+        elif path.is_file():
+            yield path
+
+
 def generate_name(root: str | Path):
     rootpath = Path(root)
     date = datetime.datetime.now().strftime("%Y-%m-%d %H%M%S")
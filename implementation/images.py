@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Sequence
+import pymupdf
+from .configuration import Settings
+from .parallel import ordered_map, resolve_worker_count
+
+RectTuple = tuple[float, float, float, float]
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+DEFAULT_JPEG_QUALITY = 85
+"""Quality of downsampled JPEG images if image_quality is not set."""
+
+
+class PreparedImage(NamedTuple):
+    page: bytes
+    original_size: int
+    """Size of the image file in bytes."""
+    prepared_size: int
+    """Size of the prepared page in bytes."""
+
+
+def get_rotation(transform: Sequence[float]) -> int | None:
+    """Returns how many degrees the image has to be rotated by insert_image to get the orientation
+    MuPDF uses for the image (e.g. taken from EXIF).
+    Returns None if the image is also mirrored - insert_image cannot do that.
+    """
+    a, b, c, d = transform[:4]
+    if b == 0 and c == 0:
+        if a > 0 and d > 0:
+            return 0
+        if a < 0 and d < 0:
+            return 180
+    if a == 0 and d == 0:
+        if b > 0 > c:
+            return 270
+        if b < 0 < c:
+            return 90
+    return None
+
+
+def get_target_size(width: int, height: int, rotation: int, image_rect: pymupdf.Rect, max_dpi: int):
+    """Returns the pixel size the image should be downsampled to, so that it does not exceed max_dpi
+    when fitted into image_rect. Returns None if the image does not need to be downsampled.
+    """
+    if max_dpi <= 0:
+        return None
+    displayed_width, displayed_height = (height, width) if rotation in (90, 270) else (width, height)
+    points_per_pixel = min(image_rect.width / displayed_width, image_rect.height / displayed_height)
+    dpi = 72 / points_per_pixel
+    if dpi <= max_dpi:
+        return None
+    factor = max_dpi / dpi
+    return (max(1, round(width * factor)), max(1, round(height * factor)))
+
+
+def resample_image(file: Path, target_size: tuple[int, int] | None, quality: int) -> bytes | None:
+    """Returns the image downsampled to target_size and/or recompressed as a JPEG of the given quality.
+    JPEG images are downsampled as JPEG (of DEFAULT_JPEG_QUALITY if quality is 0), images with transparency
+    are stored as PNG, other images as PNG unless quality is given.
+    Returns None if the original image should be used, because the result would not be smaller.
+    """
+    if target_size is None and quality <= 0:
+        return None
+    pixmap = pymupdf.Pixmap(file)
+    if target_size is not None:
+        pixmap = pymupdf.Pixmap(pixmap, target_size[0], target_size[1], None)
+    if quality <= 0 and file.suffix.lower() in JPEG_EXTENSIONS:
+        quality = DEFAULT_JPEG_QUALITY
+    if quality > 0 and not pixmap.alpha:
+        data = pixmap.tobytes("jpg", jpg_quality=quality)
+    else:
+        if pixmap.colorspace is not None and pixmap.colorspace.n not in (1, 3):  # PNG cannot store e.g. CMYK
+            pixmap = pymupdf.Pixmap(pymupdf.csRGB, pixmap)
+        data = pixmap.tobytes("png")
+    if len(data) >= os.path.getsize(file):
+        return None
+    return data
+
+
+def prepare_image(
+    file: Path, page_rect: RectTuple, image_rect: RectTuple, max_dpi: int = 0, quality: int = 0
+) -> PreparedImage:
+    """Creates a one-page PDF with the image placed directly on the page (JPEG and JPX data is not re-encoded,
+    unless max_dpi or quality say otherwise). Runs in a worker process, so it returns only plain data.
+    """
+    # pylint: disable=too-many-arguments
+    image_rect = pymupdf.Rect(image_rect)
+    with pymupdf.open(file) as img, pymupdf.open() as page_doc:
+        image_info = img[0].get_image_info()
+        rotation = get_rotation(image_info[0]["transform"]) if len(image_info) == 1 else None
+        page = page_doc.new_page(width=page_rect[2], height=page_rect[3])
+        if rotation is not None:
+            target_size = get_target_size(
+                image_info[0]["width"], image_info[0]["height"], rotation, image_rect, max_dpi
+            )
+            resampled = resample_image(file, target_size, quality)
+            if resampled is None:
+                page.insert_image(image_rect, filename=file, rotate=rotation, keep_proportion=True)
+            else:
+                page.insert_image(image_rect, stream=resampled, rotate=rotation, keep_proportion=True)
+        else:
+            # mirrored images can only be drawn the way MuPDF draws them
+            with pymupdf.open("pdf", img.convert_to_pdf()) as img_pdf:
+                page.show_pdf_page(image_rect, img_pdf, pno=0, keep_proportion=True, rotate=0)
+        page_bytes = page_doc.tobytes(deflate=True)
+    return PreparedImage(page_bytes, os.path.getsize(file), len(page_bytes))
+
+
+def get_image_preparer(
+    page_rect: pymupdf.Rect, image_rect: pymupdf.Rect, config: Settings
+) -> Callable[[Path], PreparedImage]:
+    """Returns prepare_image with all arguments but the file bound. It can be sent to worker processes."""
+    return partial(
+        prepare_image,
+        page_rect=tuple(page_rect),
+        image_rect=tuple(image_rect),
+        max_dpi=config.max_image_dpi,
+        quality=config.image_quality,
+    )
+
+
+def prepare_images(
+    image_paths: Sequence[Path], prepare: Callable[[Path], PreparedImage], workers: int, stack: ExitStack
+) -> Iterator[PreparedImage]:
+    """Returns prepared image pages in the order of `image_paths`.
+    With more than one worker, images are prepared in worker processes ahead of being consumed.
+    """
+    workers = resolve_worker_count(workers, len(image_paths))
+    if workers == 1:
+        return map(prepare, image_paths)
+    executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+    return ordered_map(executor, prepare, image_paths, window=2 * workers)
@@ -0,0 +1,242 @@
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from .cache import ConversionCache
+from .logger import printlog
+
+TEMP_DIRECTORY = Path(tempfile.gettempdir()).joinpath("Zszywacz")
+# worker N listens on LISTENER_BASE_PORT + N
+LISTENER_BASE_PORT = 20020
+# how long to wait for a background LibreOffice to start listening, in seconds
+LISTENER_TIMEOUT = 30
+# how long a single conversion can take, in seconds, before LibreOffice is considered hung and is stopped
+CONVERSION_TIMEOUT = 600
+# processes merging at the same time (see set_worker_slot) use separate ranges of worker indexes of this size
+WORKERS_PER_SLOT = 100
+
+_FIRST_WORKER_INDEX = 0
+
+
+def set_worker_slot(slot: int):
+    """Makes pools of this process use their own profiles and ports, so that they do not block pools
+    of other processes merging at the same time (each of them with a different slot).
+    """
+    # pylint: disable=global-statement
+    global _FIRST_WORKER_INDEX
+    _FIRST_WORKER_INDEX = slot * WORKERS_PER_SLOT
+
+
+def stop_process_tree(process: subprocess.Popen, force: bool = False):
+    """Stops the process started with start_new_session=True and all processes it started.
+    soffice is only a launcher, so stopping it alone would leave LibreOffice running.
+    """
+    if process.poll() is None:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/PID", str(process.pid), "/T", "/F"], capture_output=True, check=False)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+        process.wait()
+
+
+def run_process(command: list[str], timeout: float):
+    """Runs the command like subprocess.run(check=True, capture_output=True), but stops the whole process tree
+    if it does not finish in `timeout` seconds (raising subprocess.TimeoutExpired).
+    """
+    # pylint: disable=consider-using-with
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        stop_process_tree(process, force=True)
+        process.communicate()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+
+
+def is_listening(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+class LibreWorker:
+    """A LibreOffice profile used by one conversion at a time.
+
+    Optionally a headless LibreOffice instance is kept running in the background with this profile.
+    LibreOffice allows one instance per profile: a `soffice --convert-to` call using the same profile passes
+    its command line to the running instance (over the pipe LibreOffice opens for every profile, the same way
+    a document is opened in an already open window), waits until the instance has converted the document
+    and exits. So the startup cost of LibreOffice is paid only once. The socket the instance accepts
+    connections on is only used to find out that it has started (and whether an instance left by
+    a previous run is still running), conversions do not go through it.
+    """
+
+    def __init__(self, libreoffice_path: Path, index: int):
+        self.libreoffice_path = libreoffice_path
+        self.profile = TEMP_DIRECTORY.joinpath(f"profile_{index}")
+        self.port = LISTENER_BASE_PORT + index
+        self.server: subprocess.Popen | None = None
+        self.server_checked = False
+
+    def start_server(self) -> bool:
+        """Makes sure a LibreOffice instance with this profile is listening. Returns False if it could not be started.
+        An instance left by a previous run (with libreoffice_keep_running) is reused.
+        """
+        self.server_checked = True
+        if is_listening(self.port):
+            return True
+        try:
+            # pylint: disable=consider-using-with
+            self.server = subprocess.Popen(
+                [
+                    str(self.libreoffice_path),
+                    f"-env:UserInstallation={self.profile.absolute().as_uri()}",
+                    "--headless",
+                    "--invisible",
+                    "--nologo",
+                    "--nodefault",
+                    "--norestore",
+                    f"--accept=socket,host=127.0.0.1,port={self.port};urp;",
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,  # own process group, so that the whole tree can be stopped
+            )
+        except OSError:
+            return False
+        deadline = time.monotonic() + LISTENER_TIMEOUT
+        while time.monotonic() < deadline and self.server.poll() is None:
+            if is_listening(self.port):
+                return True
+            time.sleep(0.1)
+        self.stop_server()
+        return False
+
+    def stop_server(self, force: bool = False):
+        """Stops the instance started by this run (an instance left by a previous run cannot be stopped)."""
+        if self.server is None:
+            return
+        stop_process_tree(self.server, force)
+        self.server = None
+
+    def convert(self, document_path: Path, output_directory: Path):
+        """Converts the document with this profile, stopping LibreOffice if it takes over CONVERSION_TIMEOUT.
+        The background instance is then started again for the next document.
+        """
+        # .\soffice.exe -env:UserInstallation=file:///PROFILE --convert-to pdf 'PATH' --outdir 'DIR'
+        command = [
+            str(self.libreoffice_path),
+            f"-env:UserInstallation={self.profile.absolute().as_uri()}",
+            "--convert-to",
+            "pdf",
+            str(document_path),
+            "--outdir",
+            str(output_directory),
+        ]
+        try:
+            run_process(command, CONVERSION_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            printlog("LibreTimeout", document_path, CONVERSION_TIMEOUT)
+            self.stop_server(force=True)  # the document may hang in the background instance
+            self.server_checked = False
+            raise
+
+
+class LibrePool:
+    """Converts office documents to PDF with up to `workers` LibreOffice processes running at once.
+
+    Every worker has its own LibreOffice user profile (passed with -env:UserInstallation),
+    because LibreOffice instances sharing a profile block each other. Profiles are kept between runs,
+    so that only the first conversion of a worker pays for creating the profile.
+
+    With `server` every worker keeps a LibreOffice instance running in the background for the whole run
+    (or longer with `keep_running`). If the instance cannot be started, the worker falls back to starting
+    LibreOffice once per document.
+
+    If a `cache` is given, documents found in it are not converted at all and new conversions are stored in it.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        libreoffice_path: Path,
+        workers: int,
+        server: bool = False,
+        keep_running: bool = False,
+        cache: ConversionCache | None = None,
+    ):
+        # pylint: disable=too-many-arguments
+        self.server = server
+        self.keep_running = keep_running
+        self.cache = cache
+        self._workers = [LibreWorker(libreoffice_path, _FIRST_WORKER_INDEX + i) for i in range(workers)]
+        self._idle_workers: queue.Queue[LibreWorker] = queue.Queue()
+        for worker in self._workers:
+            self._idle_workers.put(worker)
+        os.makedirs(TEMP_DIRECTORY, exist_ok=True)
+        self._output_root = Path(tempfile.mkdtemp(dir=TEMP_DIRECTORY))
+        self._job_count = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, document_path: Path) -> Future[Path]:
+        """Schedules conversion of the document. The future resolves to the path of the converted PDF."""
+        # every document gets its own output directory, so files with the same name do not overwrite each other
+        output_directory = self._output_root.joinpath(str(self._job_count))
+        self._job_count += 1
+        return self._executor.submit(self._convert, document_path, output_directory)
+
+    def _convert(self, document_path: Path, output_directory: Path) -> Path:
+        if self.cache is None:
+            return self._run_libreoffice(document_path, output_directory)
+        key = self.cache.key(document_path)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        return self.cache.put(key, self._run_libreoffice(document_path, output_directory))
+
+    def _run_libreoffice(self, document_path: Path, output_directory: Path) -> Path:
+        worker = self._idle_workers.get()
+        converted = output_directory.joinpath(document_path.with_suffix(".pdf").name)
+        try:
+            if self.server and not worker.server_checked and not worker.start_server():
+                printlog("LibreServerFailed", worker.port)
+            worker.convert(document_path, output_directory)
+            if not converted.exists() and worker.server is not None:
+                # the background instance did not take the document over, convert it without the instance
+                printlog("LibreHandoffFailed", worker.port)
+                worker.stop_server()
+                worker.convert(document_path, output_directory)
+        finally:
+            self._idle_workers.put(worker)
+        if not converted.exists():
+            raise FileNotFoundError(f"LibreOffice did not convert '{document_path}'")
+        return converted
+
+    def close(self):
+        """Waits for running conversions, stops background instances (unless they should keep running)
+        and removes all converted files (except the cached ones).
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if not self.keep_running:
+            for worker in self._workers:
+                worker.stop_server()
+        if self.cache is not None:
+            self.cache.close()
+        shutil.rmtree(self._output_root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
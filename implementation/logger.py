@@ -1,7 +1,13 @@
 from pathlib import Path
 import json
+import sys
+import time
 
 _QUIET: bool = False
+# True while the progress status line is the last thing printed (without a newline)
+_STATUS_LINE_SHOWN: bool = False
+# how often the progress status line is rewritten, in seconds
+PROGRESS_INTERVAL = 0.25
 
 _ENGLISH_LOCALIZATION: dict[str, str] = {
     "FilesToProcess": """
@@ -16,14 +22,54 @@ _ENGLISH_LOCALIZATION: dict[str, str] = {
     "GeneratedDefaultConfig": "Generated default configration file.",
     "ConfigNotFound": "Configuration file '{0}' not found. Aborting...",
     "ConfigSaved": "Configuration saved to '{0}'",
+    "ConfigInvalid": "Invalid configuration value: {0}. Aborting...",
     "FileSkipped": "File '{0}' skipped due to unknown extension.",
     "LibreMissing": "Attempted to merge a document file, but LibreOffice is not installed. File '{0}' is ignored.",
     "ConfirmExit": "Press ENTER to exit...",
     "InputSorted": "Sorted all input paths alphabetically.",
     "WhatIfMode": 'Program was run in "What if?" mode. No output PDF was created.',
+    "LibreServerFailed": (
+        "Could not start LibreOffice in the background (port {0}). Documents will be converted by starting "
+        "LibreOffice for each of them."
+    ),
+    "LibreHandoffFailed": (
+        "LibreOffice running in the background (port {0}) did not convert a document. Documents will be "
+        "converted by starting LibreOffice for each of them."
+    ),
+    "LibreTimeout": "Converting '{0}' took over {1} seconds. LibreOffice was stopped.",
+    "ImagesResized": "Images: {0} before, {1} after resizing and recompressing.",
+    "OutputCompacted": "Compacted output: {0} of merged data saved as {1}.",
+    "Progress": "Files: {0}/{1} | pages: {2} | {3}/s | time left: {4}",
+    "ProgressNoTotal": "Files: {0} | pages: {1} | {2}/s",
+    "ProfileStages": "Profile (total {0} s):",
+    "ProfileStage": "  {0}: {1} s ({2} s CPU), {3} read, {4} written.",
+    "ProfilePeakMemory": "Peak memory: {0}.",
+    "ProfileSlowestFiles": "Slowest files:",
+    "ProfileFile": "  {0} s - '{1}'",
+    "ProfileSaved": "Profile report saved in '{0}'.",
+    "Appending": "Appending {0} new files to '{1}'.",
+    "AppendNothingNew": "No new files to append to '{0}'.",
+    "AppendRebuild": (
+        "Cannot append to '{0}', because it is not known which files it contains. All files are merged again."
+    ),
+    "AppendChanged": "File '{0}' changed since it was merged. Its pages in the output are not updated.",
+    "UpToDate": "'{0}' is up to date, nothing was merged. Use --force to merge anyway.",
+    "JobStarted": "Job {0}: merging into '{1}'.",
+    "BatchSummary": "Batch finished in {0} s: {1} jobs, {2} failed.",
+    "JobMerged": "  Job {0}: {2} pages in {3} s - '{1}'",
+    "JobUpToDate": "  Job {0}: up to date - '{1}'",
+    "JobFailed": "  Job {0}: FAILED after {3} s - '{1}': {4}",
+    "BatchFileInvalid": "Batch file '{0}' cannot be read: {1}. Aborting...",
+    "BatchUnknownSetting": "Job {0}: unknown setting '{1}' is ignored.",
+    "ServerListening": "Merge server listening on {0} with {1} workers. Press CTRL-C to stop.",
+    "ServerStopped": "Merge server stopped.",
+    "PartSaved": "Part {0}: {1} pages saved in '{2}'.",
+    "OutputSplit": "Output split into {0} parts, {1} pages in total.",
 }
 
 CURRENT_LOCALIZATION: dict[str, str] = _ENGLISH_LOCALIZATION
+# directory and pattern of the loaded language file
+_LANGUAGE_PATTERN: tuple[Path, str] | None = None
 
 
 def set_quiet(is_quiet: bool):
@@ -38,9 +84,12 @@ def get_quiet():
 
 def set_language_from_file(path: Path, identifier: str | None):
     pattern = f".{identifier}" if identifier else "*"
-    lang_files = sorted(path.glob(f"language{pattern}.json"))
     # pylint: disable=global-statement
-    global CURRENT_LOCALIZATION
+    global CURRENT_LOCALIZATION, _LANGUAGE_PATTERN
+    if _LANGUAGE_PATTERN == (path, pattern):  # already loaded, e.g. the same language is set in the config
+        return
+    _LANGUAGE_PATTERN = (path, pattern)
+    lang_files = sorted(path.glob(f"language{pattern}.json"))
     for lang_file in lang_files:
         if lang_file.exists():
             with open(lang_file, "r", encoding="utf8") as f:
@@ -58,13 +107,110 @@ def log(msg_key: str, *args, **kwargs):
         return _ENGLISH_LOCALIZATION[msg_key].format(*args, **kwargs)
 
 
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes:02}:{seconds:02}"
+
+
+def clear_status_line():
+    """Removes the progress status line, so that the next message is not printed after it."""
+    # pylint: disable=global-statement
+    global _STATUS_LINE_SHOWN
+    if _STATUS_LINE_SHOWN:
+        sys.stdout.write("\r\033[K")
+        _STATUS_LINE_SHOWN = False
+
+
 def printline():
     if _QUIET:
         return
+    clear_status_line()
     print("")
 
 
 def printlog(msg_key: str, *args, **kwargs):
     log_or_not = log(msg_key, *args, **kwargs)
     if log_or_not:
+        clear_status_line()
         print(log_or_not)
+
+
+def printlines(lines: list[str]):
+    """Prints all lines with a single write, which is much faster than printing them one by one on some consoles."""
+    if _QUIET or not lines:
+        return
+    clear_status_line()
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+class Progress:
+    """Reports which files are being merged.
+
+    By default a Stitching message is printed for every file. When enabled, a single status line is rewritten
+    instead (at most every PROGRESS_INTERVAL seconds), showing how many files and pages were merged,
+    the throughput and (if the number of files is known) the estimated time left.
+    Messages printed in the meantime appear above the status line.
+    """
+
+    def __init__(self, enabled: bool, total_files: int | None = None):
+        self.enabled = enabled and not _QUIET
+        self.total_files = total_files
+        self.merged_files = 0
+        self.pages = 0
+        self.merged_size = 0
+        self._start_time = time.monotonic()
+        self._last_update = 0.0
+
+    def next_file(self, file: Path, pages: int, merged_size: int):
+        """Called before merging each file, with the number of pages and bytes merged so far."""
+        if not self.enabled:
+            printlog("Stitching", file)
+            return
+        self._update(pages, merged_size)
+        self.merged_files += 1
+
+    def finish(self, pages: int, merged_size: int):
+        """Shows the final status, if enabled."""
+        if not self.enabled:
+            return
+        self.pages = pages
+        self.merged_size = merged_size
+        clear_status_line()
+        print(self._status())
+
+    def _update(self, pages: int, merged_size: int):
+        self.pages = pages
+        self.merged_size = merged_size
+        now = time.monotonic()
+        if now - self._last_update < PROGRESS_INTERVAL:
+            return
+        self._last_update = now
+        # pylint: disable=global-statement
+        global _STATUS_LINE_SHOWN
+        sys.stdout.write("\r" + self._status() + "\033[K")
+        sys.stdout.flush()
+        _STATUS_LINE_SHOWN = True
+
+    def _status(self) -> str:
+        elapsed = max(time.monotonic() - self._start_time, 1e-6)
+        speed = format_size(self.merged_size / elapsed)
+        if self.total_files is None:
+            return str(log("ProgressNoTotal", self.merged_files, self.pages, speed))
+        time_left = None
+        if self.merged_files:
+            time_left = elapsed / self.merged_files * (self.total_files - self.merged_files)
+        return str(
+            log("Progress", self.merged_files, self.total_files, self.pages, speed, format_duration(time_left))
+        )
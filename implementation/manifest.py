@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable, NamedTuple
+from .cache import hash_file
+from .logger import printlog
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_path: Path) -> Path:
+    """The manifest is stored next to the output, e.g. 'merged.pdf' -> 'merged.merged.json'."""
+    return output_path.with_name(output_path.stem + ".merged.json")
+
+
+def file_key(path: Path) -> str:
+    return os.path.normcase(str(path.absolute()))
+
+
+class ManifestEntry(NamedTuple):
+    size: int
+    modified: int
+    """Modification time in nanoseconds."""
+
+    @staticmethod
+    def of(path: Path) -> "ManifestEntry":
+        stat = path.stat()
+        return ManifestEntry(stat.st_size, stat.st_mtime_ns)
+
+
+def input_fingerprint(files: Iterable[Path], settings: dict, hash_contents: bool) -> str:
+    """Returns a hash of the list of input files (in order, with their sizes and modification times
+    or, with `hash_contents`, hashes of their contents) and the settings, which together determine the output.
+    """
+    described_files = []
+    for path in files:
+        try:
+            entry = ManifestEntry.of(path)
+            described = [file_key(path), entry.size, hash_file(path) if hash_contents else entry.modified]
+        except OSError:
+            described = [file_key(path)]
+        described_files.append(described)
+    data = json.dumps({"files": described_files, "settings": settings}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+
+class Manifest:
+    """List of files merged into an output PDF, stored in a JSON file next to it.
+
+    Together with the list the size of the output is stored, so that an output changed by something else
+    (and which may no longer contain the listed files) is recognized.
+    The fingerprint of the inputs of the last merge (see `input_fingerprint`) tells if the output is up to date.
+    """
+
+    def __init__(self, entries: dict[str, ManifestEntry] | None = None, output_size: int = 0, fingerprint: str = ""):
+        self.entries = entries or {}
+        self.output_size = output_size
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def load(output_path: Path) -> "Manifest | None":
+        """Returns the manifest of the output, or None if there is none or it does not match the output."""
+        try:
+            with open(manifest_path(output_path), "r", encoding="utf8") as fp:
+                data = json.load(fp)
+            if data.get("version") != MANIFEST_VERSION:
+                return None
+            manifest = Manifest(
+                {key: ManifestEntry(*value) for key, value in data["files"].items()},
+                data["output_size"],
+                data.get("fingerprint", ""),
+            )
+            if output_path.stat().st_size != manifest.output_size:
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return manifest
+
+    def save(self, output_path: Path):
+        self.output_size = output_path.stat().st_size
+        data = {
+            "version": MANIFEST_VERSION,
+            "output_size": self.output_size,
+            "fingerprint": self.fingerprint,
+            "files": {key: list(entry) for key, entry in self.entries.items()},
+        }
+        with open(manifest_path(output_path), "w", encoding="utf8") as fp:
+            json.dump(data, fp, indent=2)
+
+    def is_new(self, path: Path) -> bool:
+        """Returns True if the file was not merged yet. Prints a message if it was merged, but changed since then."""
+        entry = self.entries.get(file_key(path))
+        if entry is None:
+            return True
+        try:
+            if ManifestEntry.of(path) != entry:
+                printlog("AppendChanged", path)
+        except OSError:
+            pass
+        return False
+
+    def add(self, paths: Iterable[Path]):
+        for path in paths:
+            self.entries[file_key(path)] = ManifestEntry.of(path)
+
+
+def is_up_to_date(output_path: Path, fingerprint: str) -> bool:
+    """Returns True if the output exists and was merged from inputs with the same fingerprint."""
+    manifest = Manifest.load(output_path)
+    return manifest is not None and manifest.fingerprint == fingerprint
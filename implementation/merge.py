@@ -1,68 +1,468 @@
-import subprocess
-import tempfile
+import itertools
 import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Sequence
+from typing import Callable, Iterable, Iterator, Sequence
 import pymupdf
-from .configuration import Configuration
-from .logger import printline, printlog
+from .configuration import Settings
+from .logger import Progress, format_size, printline, printlog
 from .dimension import Dimension
 from .files import is_image_extension, is_pdf_extension, is_document_extension
+from .cache import ConversionCache
+from .manifest import Manifest
+from .images import PreparedImage, get_image_preparer, prepare_images
+from .libre import TEMP_DIRECTORY, LibrePool
+from .output import OutputDocument, SourceDocuments
+from .parallel import iterate_in_thread, resolve_worker_count
+from .prefetch import PrefetchedFile, Prefetcher
+from .profiling import measure
+from .shards import MIN_SHARD_SIZE, MergedShard, submit_shards
+from .split import SubmittedPart, submit_parts
 
 PathLike = str | Path
 
 
-# .\soffice.exe --convert-to pdf 'PATH' --outdir 'DIR'
-def libre_to_pdf(document_path: Path, config: Configuration, output_file: pymupdf.Document, dry_run: bool):
+def start_conversions(
+    document_paths: Sequence[Path], config: Settings, stack: ExitStack
+) -> dict[Path, Future[Path]]:
+    """Submits all documents to a LibreOffice pool, so that they are converted while other files are merged.
+    Returns futures of converted PDFs, keyed by document path.
+    """
+    if not document_paths or not config.libreoffice_path or config.whatif:
+        return {}
+    pool = open_libre_pool(config, len(document_paths), stack)
+    return {path: pool.submit(path) for path in document_paths}
+
+
+def open_libre_pool(config: Settings, document_count: int, stack: ExitStack) -> LibrePool:
+    """Starts a LibreOffice pool with enough workers for `document_count` documents.
+    The pool is closed together with the stack.
+    """
+    workers = resolve_worker_count(config.libreoffice_workers, document_count)
+    cache = None
+    if config.conversion_cache_size > 0:
+        cache = ConversionCache(TEMP_DIRECTORY.joinpath("cache"), config.conversion_cache_size * 1024 * 1024)
+    return stack.enter_context(
+        LibrePool(config.libreoffice_path, workers, config.libreoffice_server, config.libreoffice_keep_running, cache)
+    )
+
+
+def start_prefetching(
+    files: Sequence[Path],
+    conversions: dict[Path, Future[Path]],
+    config: Settings,
+    open_sources: SourceDocuments,
+    stack: ExitStack,
+) -> Iterator[Future[PrefetchedFile] | None]:
+    """Starts reading PDFs and converted documents among `files` ahead of them being merged,
+    up to `config.prefetch_files` of them. Yields the future of every PDF and converted document
+    in the order of `files`, or None for those that should not be read ahead (PDFs already held open
+    in `open_sources`, or all of them if prefetching is off).
+    """
+    sources = [conversions.get(x, x) for x in files if is_pdf_extension(x) or x in conversions]
+    if config.prefetch_files <= 0:
+        return itertools.repeat(None, len(sources))
+    prefetcher = stack.enter_context(Prefetcher(config.prefetch_memory * 1024 * 1024))
+    is_open = [isinstance(x, Path) and x in open_sources for x in sources]
+    prefetched = prefetcher.read_ahead(
+        (x for x, x_is_open in zip(sources, is_open) if not x_is_open), config.prefetch_files
+    )
+    return (None if x_is_open else next(prefetched) for x_is_open in is_open)
+
+
+def insert_pdf(file: Path, prefetched: Future[PrefetchedFile] | None, output_file: OutputDocument):
+    if prefetched is None:
+        output_file.insert_file(file, source=file)
+        return
+    with measure("read", file):
+        prefetched_file = prefetched.result()
+    output_file.insert_file(prefetched_file, source=file)
+
+
+def libre_to_pdf(
+    document_path: Path,
+    conversion: Future[Path] | Future[PrefetchedFile] | None,
+    config: Settings,
+    output_file: OutputDocument,
+):
+    """Inserts the converted document. `conversion` resolves to the converted PDF, or to its prefetched contents."""
     if not config.libreoffice_path:
         printlog("LibreMissing", document_path)
         return
-    if dry_run:
+    if conversion is None:  # dry run
         return
-    tempdir = Path(tempfile.gettempdir()).joinpath("Zszywacz")
-    os.makedirs(tempdir, exist_ok=True)
-    subprocess.run(
-        [config.libreoffice_path, "--convert-to", "pdf", str(document_path), "--outdir", tempdir], check=True
-    )
-    output_file.insert_file(
-        tempdir.joinpath(document_path.with_suffix(".pdf").name)
-    )  # insert_file can handle pathlib.Path
+    with measure("conversion", document_path):
+        converted = conversion.result()
+    output_file.insert_file(converted, source=document_path)
 
 
-def merge_documents(files: Sequence[PathLike], output_path: Path, config: Configuration):
+def get_image_pagesize(first_page_rect: pymupdf.Rect | None, config: Settings) -> pymupdf.Rect:
+    """Returns the size of the first page of the first PDF, or the fallback size if there are no PDFs."""
+    if first_page_rect is None or config.force_image_page_fallback_size:
+        return config.image_page_fallback_size.rect
+    actual_pagesize = first_page_rect
+    dim = Dimension(actual_pagesize.width, actual_pagesize.height, "pt")
+    printlog("FirstPageSize", dim)
     printline()
-    all_filepaths = [Path(x) for x in files]
-    pdf_filepaths = [x for x in all_filepaths if is_pdf_extension(x)]
-    output_file = pymupdf.Document()
-    actual_pagesize = config.image_page_fallback_size.rect
-    if pdf_filepaths and not config.force_image_page_fallback_size:
-        first_doc = pymupdf.open(pdf_filepaths[0])
-        actual_pagesize = first_doc.load_page(0).rect
-        dim = Dimension(actual_pagesize.width, actual_pagesize.height, "pt")
-        printlog("FirstPageSize", dim)
-        printline()
-    for file in all_filepaths:
-        printlog("Stitching", file)
+    return actual_pagesize
+
+
+def merge_files(
+    files: Sequence[Path],
+    conversions: dict[Path, Future[Path]],
+    prefetched_files: Iterator[Future[PrefetchedFile] | None],
+    prepared_images: Iterator[PreparedImage],
+    config: Settings,
+    output_file: OutputDocument,
+    progress: Progress,
+) -> tuple[int, int]:
+    """Merges files one by one into output_file. `prefetched_files` are read from start_prefetching.
+    Returns the sizes of images before and after preparing them.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    images_size_before = images_size_after = 0
+    # prefetched files are not kept in variables, a file counts against the prefetch budget until it is freed
+    for file in files:
+        progress.next_file(file, output_file.page_count, output_file.inserted_size)
         if is_pdf_extension(file):
-            output_file.insert_file(file)
+            insert_pdf(file, next(prefetched_files), output_file)
         elif is_image_extension(file):
-            image_to_pdf(file, config, output_file, actual_pagesize)
+            with measure("image", file) as stats:
+                prepared_image = next(prepared_images)
+                stats.bytes_read = prepared_image.original_size
+            images_size_before += prepared_image.original_size
+            images_size_after += prepared_image.prepared_size
+            output_file.insert_bytes(prepared_image.page, source=file)
+        elif is_document_extension(file) and file in conversions:
+            libre_to_pdf(file, next(prefetched_files) or conversions[file], config, output_file)
         elif is_document_extension(file):
-            libre_to_pdf(file, config, output_file, dry_run=config.whatif)
+            libre_to_pdf(file, None, config, output_file)
         else:
             printlog("UnknownFileType", file)
-    output_path = output_path.with_suffix(".pdf")  # Make sure PDF is the extension
-    if not config.whatif:
-        output_file.save(output_path)  # save can handle pathlib.Path
+    return (images_size_before, images_size_after)
+
+
+def merge_shards(
+    files: Sequence[Path],
+    shards: list[tuple[range, Future[MergedShard]]],
+    config: Settings,
+    output_file: OutputDocument,
+    progress: Progress,
+) -> tuple[int, int]:
+    """Joins shards merged by worker processes into output_file, in order.
+    Returns the sizes of images before and after preparing them.
+    """
+    images_size_before = images_size_after = 0
+    for shard, future in shards:
+        with measure("shard"):
+            shard_path, shard_size_before, shard_size_after, _ = future.result()
+        images_size_before += shard_size_before
+        images_size_after += shard_size_after
+        for file in (files[i] for i in shard):
+            progress.next_file(file, output_file.page_count, output_file.inserted_size)
+            if is_document_extension(file) and not config.libreoffice_path:
+                printlog("LibreMissing", file)
+            elif not (is_pdf_extension(file) or is_image_extension(file) or is_document_extension(file)):
+                printlog("UnknownFileType", file)
+        if shard_path is not None:
+            output_file.insert_file(shard_path)
+            shard_path.unlink()
+    return (images_size_before, images_size_after)
+
+
+def save_parts(parts: Sequence[SubmittedPart], config: Settings, progress: Progress) -> int:
+    """Waits for parts merged and saved by worker processes, in order, and reports them.
+    Removes intermediate PDFs as soon as no later part needs them. Returns the number of pages.
+    """
+    pages = inserted_size = 0
+    part_count = 0
+    for part in parts:
+        if part.future is not None:
+            with measure("part"):
+                part_pages, part_size = part.future.result()
+            pages += part_pages
+            inserted_size += part_size
+        for file in part.files:
+            progress.next_file(file, pages, inserted_size)
+            if is_document_extension(file) and not config.libreoffice_path:
+                printlog("LibreMissing", file)
+            elif not (is_pdf_extension(file) or is_image_extension(file) or is_document_extension(file)):
+                printlog("UnknownFileType", file)
+        for shard_path in part.finished_shards:  # earlier parts are saved already
+            shard_path.unlink()
+        if part.future is not None:
+            part_count += 1
+            if not config.whatif:
+                printlog("PartSaved", part_count, part_pages, part.path.absolute())
+    progress.finish(pages, inserted_size)
+    return pages
+
+
+class StreamedMerge:
+    """Merges files in the order they arrive, e.g. while directories are still being searched.
+
+    Files are looked ahead by up to `window` places: images are prepared and documents converted
+    by worker pools (started when the first image or document arrives) and PDFs are read into memory,
+    while earlier files are inserted.
+    Image pages get the size of the first PDF that arrived before the first image (or the fallback size).
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config: Settings, output_file: OutputDocument, progress: Progress, stack: ExitStack):
+        self.config = config
+        self.output_file = output_file
+        self.progress = progress
+        self.stack = stack
+        cpu_count = os.cpu_count() or 1
+        self.image_workers = resolve_worker_count(config.image_workers, cpu_count)
+        self.window = max(
+            2 * max(self.image_workers, resolve_worker_count(config.libreoffice_workers, cpu_count)),
+            config.prefetch_files,
+        )
+        self.first_page_rect: pymupdf.Rect | None = None
+        self.prepare: Callable[[Path], PreparedImage] | None = None
+        self.image_executor: ProcessPoolExecutor | None = None
+        self.libre_pool: LibrePool | None = None
+        self.prefetcher: Prefetcher | None = None
+        self.images_size_before = 0
+        self.images_size_after = 0
+
+    def start(self, file: Path) -> Future | None:
+        """Starts preparing the file. Returns the future of the prepared image, converted document
+        or prefetched PDF, or None if there is nothing to do in advance.
+        """
+        if is_pdf_extension(file):
+            if self.first_page_rect is None and self.prepare is None and not self.config.force_image_page_fallback_size:
+                # the PDF stays open until it is inserted
+                self.first_page_rect = self.output_file.sources.first_page_rect(file)
+                return None
+            return self.prefetch(file)
+        elif is_image_extension(file):
+            prepare = self.get_image_preparer()
+            if self.image_workers > 1:
+                if self.image_executor is None:
+                    self.image_executor = self.stack.enter_context(ProcessPoolExecutor(self.image_workers))
+                return self.image_executor.submit(prepare, file)
+        elif is_document_extension(file) and self.config.libreoffice_path and not self.config.whatif:
+            if self.libre_pool is None:
+                self.libre_pool = open_libre_pool(self.config, os.cpu_count() or 1, self.stack)
+            conversion = self.libre_pool.submit(file)
+            return self.prefetch(conversion) or conversion
+        return None
+
+    def prefetch(self, source: Path | Future[Path]) -> Future[PrefetchedFile] | None:
+        """Starts reading the PDF (or the converted document) into memory. Returns None if nothing is read ahead."""
+        if self.config.prefetch_files <= 0:
+            return None
+        if self.prefetcher is None:
+            self.prefetcher = self.stack.enter_context(Prefetcher(self.config.prefetch_memory * 1024 * 1024))
+        return self.prefetcher.submit(source)
+
+    def get_image_preparer(self) -> Callable[[Path], PreparedImage]:
+        if self.prepare is None:
+            actual_pagesize = get_image_pagesize(self.first_page_rect, self.config)
+            self.prepare = get_image_preparer(
+                actual_pagesize, (-self.config.margin + actual_pagesize).rect, self.config
+            )
+        return self.prepare
+
+    def insert(self, file: Path, started: Future | None):
+        self.progress.next_file(file, self.output_file.page_count, self.output_file.inserted_size)
+        if is_pdf_extension(file):
+            insert_pdf(file, started, self.output_file)
+        elif is_image_extension(file):
+            with measure("image", file) as stats:
+                prepared_image = started.result() if started else self.get_image_preparer()(file)
+                stats.bytes_read = prepared_image.original_size
+            self.images_size_before += prepared_image.original_size
+            self.images_size_after += prepared_image.prepared_size
+            self.output_file.insert_bytes(prepared_image.page, source=file)
+        elif is_document_extension(file):
+            libre_to_pdf(file, started, self.config, self.output_file)
+        else:
+            printlog("UnknownFileType", file)
+
+    def merge(self, files: Iterable[Path]):
+        pending: deque[tuple[Path, Future | None]] = deque()
+        for file in files:
+            pending.append((file, self.start(file)))
+            if len(pending) > self.window:
+                self.insert(*pending.popleft())
+        while pending:
+            self.insert(*pending.popleft())
+
+
+def save_output(output_file: OutputDocument, config: Settings, images_sizes: tuple[int, int] | None):
+    """Saves the merged document and prints a summary. `images_sizes` is None if no images were merged."""
+    if images_sizes is not None and (config.max_image_dpi > 0 or config.image_quality > 0):
+        printline()
+        printlog("ImagesResized", format_size(images_sizes[0]), format_size(images_sizes[1]))
+    with measure("save") as stats:
+        output_file.save()
+        if not config.whatif:
+            stats.bytes_written = output_file.path.stat().st_size
+    if config.compact_output and not config.whatif:
+        printline()
+        printlog(
+            "OutputCompacted", format_size(output_file.inserted_size), format_size(output_file.path.stat().st_size)
+        )
+    printline()
+    printlog("OutputSaved", output_file.path.absolute())
+
+
+def open_output(output_path: Path, config: Settings) -> tuple[OutputDocument, Manifest | None]:
+    """Creates the output document. In append mode an existing output with a matching manifest is opened
+    to be extended instead, and its manifest is returned too.
+    """
+    memory_budget = config.memory_budget * 1024 * 1024
+    if config.append and output_path.exists():
+        manifest = Manifest.load(output_path)
+        if manifest is not None:
+            output_file = OutputDocument(output_path, memory_budget, dry_run=config.whatif, append=True)
+            if output_file.document.can_save_incrementally():
+                return (output_file, manifest)
+            output_file.document.close()
+        printlog("AppendRebuild", output_path)
+    return (OutputDocument(output_path, memory_budget, dry_run=config.whatif, compact=config.compact_output), None)
+
+
+def update_manifest(
+    manifest: Manifest | None, files: Iterable[Path], output_path: Path, config: Settings, fingerprint: str
+):
+    """In append mode (or if the fingerprint of the inputs is given) records the merged files and the fingerprint
+    in the output's manifest (a new one if the output was rebuilt or not appended to).
+    """
+    if not (config.append or fingerprint) or config.whatif:
+        return
+    manifest = manifest or Manifest()
+    manifest.fingerprint = fingerprint
+    libreoffice_path = config.libreoffice_path
+    manifest.add(
+        x
+        for x in files
+        if is_pdf_extension(x) or is_image_extension(x) or (is_document_extension(x) and libreoffice_path)
+    )
+    manifest.save(output_path)
+
+
+def merge_streamed_documents(
+    files: Iterable[Path], output_path: Path, config: Settings, fingerprint: str = ""
+) -> int:
+    """Merges files while they are still being found. `files` is iterated in a background thread,
+    so a slow directory scan runs at the same time as the merge. Does not use `config.jobs`.
+    `fingerprint` of the inputs is stored in the manifest, if given. Returns the number of pages of the output.
+    """
     printline()
-    printlog("OutputSaved", output_path.absolute())
+    output_path = output_path.with_suffix(".pdf")
+    output_file, manifest = open_output(output_path, config)
+    merged_files: list[Path] = []
+
+    def new_files():
+        for file in files:
+            if manifest is None or manifest.is_new(file):
+                merged_files.append(file)
+                yield file
+
+    progress = Progress(config.progress)
+    with ExitStack() as stack:
+        streamed_merge = StreamedMerge(config, output_file, progress, stack)
+        streamed_merge.merge(iterate_in_thread(new_files(), buffer_size=1024))
+    pages = output_file.page_count
+    progress.finish(pages, output_file.inserted_size)
+    if manifest is not None and not merged_files:
+        printlog("AppendNothingNew", output_path)
+    images_sizes = None
+    if streamed_merge.prepare is not None:
+        images_sizes = (streamed_merge.images_size_before, streamed_merge.images_size_after)
+    save_output(output_file, config, images_sizes)
+    update_manifest(manifest, merged_files, output_path, config, fingerprint)
+    return pages
 
 
-def image_to_pdf(file, config, output_file, actual_pagesize):
-    img = pymupdf.open(file)
-    img_pdf_bytes = img.convert_to_pdf()
-    img.close()
-    img_pdf = pymupdf.open("pdf", img_pdf_bytes)
-    new_page = output_file.new_page(width=actual_pagesize.width, height=actual_pagesize.height)
-    margined_rect = (-config.margin + new_page.rect).rect
-    new_page.show_pdf_page(margined_rect, img_pdf, pno=0, keep_proportion=True, rotate=0)
+def merge_documents(
+    files: Sequence[PathLike], output_path: Path, config: Settings, fingerprint: str = ""
+) -> int:
+    """Merges the files into the output. `fingerprint` of the inputs is stored in the manifest, if given.
+    Returns the number of pages of the output.
+    """
+    printline()
+    all_filepaths = [Path(x) for x in files]
+    output_path = output_path.with_suffix(".pdf")  # Make sure PDF is the extension
+    output_file, manifest = open_output(output_path, config)
+    # when appending, image pages get the same size as if all files were merged again
+    pdf_filepaths = [x for x in all_filepaths if is_pdf_extension(x)]
+    if manifest is not None:
+        all_filepaths = [x for x in all_filepaths if manifest.is_new(x)]
+        if all_filepaths:
+            printlog("Appending", len(all_filepaths), output_path)
+        else:
+            printlog("AppendNothingNew", output_path)
+    image_filepaths = [x for x in all_filepaths if is_image_extension(x)]
+    first_page_rect = None
+    if pdf_filepaths and not config.force_image_page_fallback_size:
+        # the PDF stays open until it is inserted
+        first_page_rect = output_file.sources.first_page_rect(pdf_filepaths[0])
+    actual_pagesize = get_image_pagesize(first_page_rect, config)
+    prepare = get_image_preparer(actual_pagesize, (-config.margin + actual_pagesize).rect, config)
+    jobs = resolve_worker_count(config.jobs, len(all_filepaths) // MIN_SHARD_SIZE)
+    progress = Progress(config.progress, len(all_filepaths))
+    with ExitStack() as stack:
+        conversions = start_conversions([x for x in all_filepaths if is_document_extension(x)], config, stack)
+        if jobs > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            shards = submit_shards(
+                all_filepaths, conversions, prepare, output_file.memory_budget, jobs, executor, stack
+            )
+            output_file.sources.close()  # sources are merged by worker processes
+            images_size_before, images_size_after = merge_shards(all_filepaths, shards, config, output_file, progress)
+        else:
+            prepared_images = prepare_images(image_filepaths, prepare, config.image_workers, stack)
+            prefetched_files = start_prefetching(all_filepaths, conversions, config, output_file.sources, stack)
+            images_size_before, images_size_after = merge_files(
+                all_filepaths, conversions, prefetched_files, prepared_images, config, output_file, progress
+            )
+    pages = output_file.page_count
+    progress.finish(pages, output_file.inserted_size)
+    save_output(output_file, config, (images_size_before, images_size_after) if image_filepaths else None)
+    update_manifest(manifest, all_filepaths, output_path, config, fingerprint)
+    return pages
+
+
+def merge_split_documents(files: Sequence[PathLike], output_path: Path, config: Settings) -> int:
+    """Merges the files into parts of at most `config.split_pages` pages and about `config.split_size` megabytes,
+    named after the output. Parts are merged and saved by `config.jobs` worker processes at the same time.
+    Append mode and the manifest are not used. Returns the number of pages of all parts.
+    """
+    printline()
+    all_filepaths = [Path(x) for x in files]
+    output_path = output_path.with_suffix(".pdf")
+    pdf_filepaths = [x for x in all_filepaths if is_pdf_extension(x)]
+    first_page_rect = None
+    # the size of image pages is only needed if there are images
+    has_images = any(is_image_extension(x) for x in all_filepaths)
+    if pdf_filepaths and has_images and not config.force_image_page_fallback_size:
+        sources = SourceDocuments()
+        first_page_rect = sources.first_page_rect(pdf_filepaths[0])
+        sources.close()  # sources are merged by worker processes
+    actual_pagesize = get_image_pagesize(first_page_rect, config)
+    prepare = get_image_preparer(actual_pagesize, (-config.margin + actual_pagesize).rect, config)
+    workers = resolve_worker_count(config.jobs, len(all_filepaths))
+    progress = Progress(config.progress, len(all_filepaths))
+    memory_budget = config.memory_budget * 1024 * 1024
+    with ExitStack() as stack:
+        conversions = start_conversions([x for x in all_filepaths if is_document_extension(x)], config, stack)
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        shards = submit_shards(all_filepaths, conversions, prepare, memory_budget, workers, executor, stack)
+        parts = submit_parts(all_filepaths, shards, output_path, config, workers, executor)
+        pages = save_parts(parts, config, progress)
+        images_size_before = sum(future.result()[1] for _, future in shards)
+        images_size_after = sum(future.result()[2] for _, future in shards)
+    if has_images and (config.max_image_dpi > 0 or config.image_quality > 0):
+        printline()
+        printlog("ImagesResized", format_size(images_size_before), format_size(images_size_after))
+    printline()
+    printlog("OutputSplit", sum(1 for x in parts if x.future is not None), pages)
+    return pages
@@ -0,0 +1,150 @@
+import os
+from pathlib import Path
+import pymupdf
+from .libre import TEMP_DIRECTORY
+from .prefetch import PrefetchedFile
+from .profiling import measure
+
+# garbage=4 also merges objects with identical streams, e.g. fonts or logos repeated in many source files
+COMPACT_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "deflate_fonts": True, "use_objstms": True}
+
+
+class SourceDocuments:
+    """Source PDFs opened before they are merged (e.g. to read the size of their first page).
+
+    A PDF opened here is kept open until it is taken for merging, so that it is parsed only once.
+    Taking a PDF that was not opened before opens it. Whoever takes a document closes it.
+    """
+
+    def __init__(self):
+        self._documents: dict[Path, pymupdf.Document] = {}
+
+    def open(self, path: Path) -> pymupdf.Document:
+        if path not in self._documents:
+            self._documents[path] = pymupdf.open(path)
+        return self._documents[path]
+
+    def __contains__(self, path: Path) -> bool:
+        """Whether the PDF is open and waits to be taken."""
+        return path in self._documents
+
+    def first_page_rect(self, path: Path) -> pymupdf.Rect:
+        return self.open(path).load_page(0).rect
+
+    def take(self, path: Path, data: bytes | None = None) -> pymupdf.Document:
+        """`data` is the contents of the PDF, if it was already read."""
+        document = self._documents.pop(path, None)
+        if document is not None:
+            return document
+        return pymupdf.open("pdf", data) if data is not None else pymupdf.open(path)
+
+    def close(self):
+        """Closes documents that were opened, but not taken."""
+        for document in self._documents.values():
+            document.close()
+        self._documents.clear()
+
+
+class OutputDocument:
+    """The merged PDF. Wraps pymupdf.Document and keeps track of how much data was inserted into it.
+
+    Without a memory budget everything is kept in memory and saved at the end.
+    With a budget, once the data inserted since the last write exceeds it, the document is written
+    to a partial file (first fully, then incrementally), closed and reopened from that file,
+    so the inserted pages no longer have to be held in memory.
+    In dry runs the partial file is placed in the temporary directory and deleted at the end.
+
+    With `compact` the output is saved with duplicate and unused objects removed and streams compressed.
+    A partial file then has to be rewritten as a whole.
+
+    With `append` the existing output is opened and new pages are added to it. It is then treated like
+    a partial file - only the changes are written (incrementally) - so it cannot be compacted.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, path: Path, memory_budget: int, dry_run: bool, compact: bool = False, append: bool = False):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.dry_run = dry_run
+        self.compact = compact and not append
+        self.document = pymupdf.open(path) if append else pymupdf.Document()
+        self.sources = SourceDocuments()
+        self.inserted_size = 0
+        """Total size of all inserted data, in bytes."""
+        self._pending_size = 0
+        self._partial_path: Path | None = path if append and not dry_run else None
+
+    @property
+    def page_count(self) -> int:
+        return self.document.page_count
+
+    def insert_file(self, file: Path | PrefetchedFile, source: Path | None = None, pages: range | None = None):
+        """Inserts all pages of the PDF (read from disk, unless it was prefetched), or only the given `pages`.
+        `source` is the merged file the PDF was made from (if any), for profiling.
+        """
+        if isinstance(file, PrefetchedFile):
+            path, data = file.path, file.data
+        else:
+            path, data = file, None
+        with measure("insert", source) as stats, self.sources.take(path, data) as pdf_document:
+            if pages is None:
+                self.document.insert_pdf(pdf_document)
+            else:
+                self.document.insert_pdf(pdf_document, from_page=pages.start, to_page=pages.stop - 1)
+            stats.bytes_read = len(data) if data is not None else os.path.getsize(path)
+        self._inserted(stats.bytes_read)
+
+    def insert_bytes(self, pdf: bytes, source: Path | None = None):
+        with measure("insert", source), pymupdf.open("pdf", pdf) as pdf_document:
+            self.document.insert_pdf(pdf_document)
+        self._inserted(len(pdf))
+
+    def _inserted(self, size: int):
+        self.inserted_size += size
+        self._pending_size += size
+        if 0 < self.memory_budget <= self._pending_size:
+            self.flush()
+
+    def _get_partial_path(self) -> Path:
+        if self.dry_run:
+            os.makedirs(TEMP_DIRECTORY, exist_ok=True)
+            return TEMP_DIRECTORY.joinpath(f"dry_run_{os.getpid()}.pdf")
+        return self.path.with_name(self.path.name + ".part")
+
+    def flush(self):
+        """Writes pages inserted so far to the partial file and releases them from memory."""
+        with measure("flush") as stats:
+            if self._partial_path is None:
+                self._partial_path = self._get_partial_path()
+                self.document.save(self._partial_path)
+                stats.bytes_written = os.path.getsize(self._partial_path)
+            else:
+                partial_size = os.path.getsize(self._partial_path)
+                self.document.saveIncr()  # document was opened from the partial file
+                stats.bytes_written = os.path.getsize(self._partial_path) - partial_size
+            self.document.close()
+            self.document = pymupdf.open(self._partial_path)
+        self._pending_size = 0
+
+    def save(self):
+        """Writes the document to its path (nothing is written in dry runs) and closes it and all sources."""
+        self.sources.close()
+        save_options = COMPACT_SAVE_OPTIONS if self.compact else {}
+        if self._partial_path is None:
+            if not self.dry_run:
+                self.document.save(self.path, **save_options)  # save can handle pathlib.Path
+            self.document.close()
+            return
+        if self._pending_size and not self.dry_run:
+            self.document.saveIncr()
+        if self.compact and not self.dry_run:
+            self.document.save(self.path, **save_options)
+            self.document.close()
+            self._partial_path.unlink()
+            return
+        self.document.close()
+        if self.dry_run:
+            self._partial_path.unlink(missing_ok=True)
+        else:
+            os.replace(self._partial_path, self.path)
@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Callable, Generator, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def resolve_worker_count(workers: int, job_count: int) -> int:
+    """Returns the number of workers to actually start. Non-positive values mean one worker per processor core.
+    There is never more workers than jobs (but always at least one worker).
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, job_count))
+
+
+def ordered_map(
+    executor: Executor, function: Callable[[T], R], items: Iterable[T], window: int
+) -> Generator[R, None, None]:
+    """Like Executor.map, but at most `window` items are submitted ahead of the one being consumed,
+    so the results waiting to be consumed do not pile up in memory.
+    Results are yielded in the order of `items`.
+    """
+    pending: deque[Future[R]] = deque()
+    iterator = iter(items)
+    for item in iterator:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            break
+    while pending:
+        future = pending.popleft()
+        for item in iterator:
+            pending.append(executor.submit(function, item))
+            break
+        yield future.result()
+
+
+class _Finished:
+    """Put into the buffer of iterate_in_thread after the last item."""
+
+    def __init__(self, error: BaseException | None = None):
+        self.error = error
+
+
+def iterate_in_thread(items: Iterable[T], buffer_size: int) -> Generator[T, None, None]:
+    """Iterates `items` in a background thread, at most `buffer_size` items ahead of the one being consumed.
+    Useful for slow iterables (like directory scans), which then run while the consumer works on earlier items.
+    Exceptions raised by the iterable are raised by this generator. When the consumer stops early
+    (the generator is closed), the thread stops after the item it is producing.
+    """
+    buffer: queue.Queue[T | _Finished] = queue.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+
+    def put(item: T | _Finished) -> bool:
+        """Waits for space in the buffer. Returns False if the consumer stopped in the meantime."""
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            put(_Finished(e))
+            return
+        put(_Finished())
+
+    # daemon, so that an iterable blocked in a slow call does not keep the program running
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _Finished):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,88 @@
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Generator, Iterable
+
+
+@dataclass
+class PrefetchedFile:
+    path: Path
+    """Path the data was read from (the converted PDF for office documents)."""
+    data: bytes
+
+
+class Prefetcher:
+    """Reads PDFs into memory in a background thread, ahead of them being merged, so that reading from disk
+    (and waiting for documents to be converted) overlaps with inserting earlier files.
+
+    PyMuPDF is not thread-safe, so files are only read here. They are parsed by the thread merging them.
+    Files are read one at a time in the order they were submitted. At most `memory_budget` bytes are held
+    at once - a larger file is read only when nothing else is held. A file stops counting against the budget
+    when its PrefetchedFile is freed.
+    """
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._condition = threading.Condition()  # reentrant, a file can be freed while the lock is held
+        self._held_size = 0
+        self._closed = False
+
+    def submit(self, source: Path | Future[Path]) -> Future[PrefetchedFile]:
+        """Schedules reading of the PDF, or of the converted PDF once the conversion is done."""
+        return self._executor.submit(self._read, source)
+
+    def read_ahead(
+        self, sources: Iterable[Path | Future[Path]], window: int
+    ) -> Generator[Future[PrefetchedFile], None, None]:
+        """Yields futures of the read sources in order. Sources are submitted at most `window` places ahead
+        of the one being consumed.
+        """
+        pending: deque[Future[PrefetchedFile]] = deque()
+        for source in sources:
+            pending.append(self.submit(source))
+            if len(pending) > window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def _read(self, source: Path | Future[Path]) -> PrefetchedFile:
+        path = source.result() if isinstance(source, Future) else source
+        size = path.stat().st_size
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or self._held_size == 0 or self._held_size + size <= self.memory_budget
+            )
+            if self._closed:
+                raise CancelledError()
+            self._held_size += size
+        try:
+            with open(path, "rb") as fp:
+                prefetched = PrefetchedFile(path, fp.read())
+        except BaseException:
+            self._release(size)
+            raise
+        self._release(size - len(prefetched.data))  # the file could have changed in the meantime
+        weakref.finalize(prefetched, self._release, len(prefetched.data))
+        return prefetched
+
+    def _release(self, size: int):
+        with self._condition:
+            self._held_size -= size
+            self._condition.notify_all()
+
+    def close(self):
+        """Stops reading. Files waiting for the budget are cancelled."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
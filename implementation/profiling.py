@@ -0,0 +1,198 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Generator, Iterable, TypeVar
+from .logger import format_size, printline, printlog
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+# how many of the slowest files are printed in the summary
+SLOWEST_FILE_COUNT = 10
+
+
+def get_peak_memory() -> int | None:
+    """Returns the peak resident memory of this process in bytes, or None if it cannot be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # kilobytes everywhere but macOS
+    if os.name == "nt":
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+@dataclass
+class StageStats:
+    """Totals of all measurements of a stage (or of a stage of one file)."""
+
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    """CPU time of the thread doing the measured work. Worker processes are not included."""
+    bytes_read: int = 0
+    bytes_written: int = 0
+    peak_memory: int | None = None
+    """Peak memory of the process when a measurement of the stage ended."""
+    count: int = 0
+
+    def add(self, other: "StageStats"):
+        self.wall_time += other.wall_time
+        self.cpu_time += other.cpu_time
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.count += other.count
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+
+
+class Profiler:
+    """Records wall time, CPU time, bytes read and written and peak memory of every stage of the merge
+    (scan, conversion, image, read, insert, shard, part, save) and of the stages of every merged file.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, StageStats] = {}
+        self.files: dict[str, dict[str, StageStats]] = {}
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()  # the scan can be measured in a background thread
+
+    @contextmanager
+    def measure(self, stage: str, file: Path | None = None) -> Generator[StageStats, None, None]:
+        """Measures the code in the with block. Bytes read and written can be added to the yielded stats."""
+        stats = StageStats(count=1)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield stats
+        finally:
+            stats.wall_time = time.perf_counter() - start_wall
+            stats.cpu_time = time.thread_time() - start_cpu
+            stats.peak_memory = get_peak_memory()
+            with self._lock:
+                self.stages.setdefault(stage, StageStats()).add(stats)
+                if file is not None:
+                    self.files.setdefault(str(file), {}).setdefault(stage, StageStats()).add(stats)
+
+    def report(self) -> dict:
+        return {
+            "total_time": time.monotonic() - self._start_time,
+            "peak_memory": get_peak_memory(),
+            "stages": {name: asdict(stats) for name, stats in self.stages.items()},
+            "files": {
+                file: {name: asdict(stats) for name, stats in stages.items()} for file, stages in self.files.items()
+            },
+        }
+
+    def slowest_files(self, count: int) -> list[tuple[str, float]]:
+        times = [(file, sum(s.wall_time for s in stages.values())) for file, stages in self.files.items()]
+        return sorted(times, key=lambda x: x[1], reverse=True)[:count]
+
+
+_PROFILER: Profiler | None = None
+_NOT_RECORDED = StageStats()
+
+
+def start_profiling():
+    # pylint: disable=global-statement
+    global _PROFILER
+    _PROFILER = Profiler()
+
+
+def stop_profiling():
+    """Stops recording without a report."""
+    # pylint: disable=global-statement
+    global _PROFILER
+    _PROFILER = None
+
+
+def get_profiler() -> Profiler | None:
+    return _PROFILER
+
+
+@contextmanager
+def measure(stage: str, file: Path | None = None) -> Generator[StageStats, None, None]:
+    """Measures the with block as part of the stage (and the file's stage), if profiling was started."""
+    if _PROFILER is None:
+        yield _NOT_RECORDED
+        return
+    with _PROFILER.measure(stage, file) as stats:
+        yield stats
+
+
+def measure_iteration(stage: str, items: Iterable[T]) -> Generator[T, None, None]:
+    """Yields items, measuring the time spent getting each of them (e.g. by a directory scan) as part of the stage."""
+    iterator = iter(items)
+    while True:
+        with measure(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def report_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.stem + ".profile.json")
+
+
+def finish_profiling(output_path: Path, save_report: bool):
+    """Prints a summary of the stages and the slowest files and saves the report next to the output PDF."""
+    if _PROFILER is None:
+        return
+    report = _PROFILER.report()
+    printline()
+    printlog("ProfileStages", f"{report['total_time']:.2f}")
+    for name, stats in _PROFILER.stages.items():
+        printlog(
+            "ProfileStage",
+            name,
+            f"{stats.wall_time:.2f}",
+            f"{stats.cpu_time:.2f}",
+            format_size(stats.bytes_read),
+            format_size(stats.bytes_written),
+        )
+    if report["peak_memory"] is not None:
+        printlog("ProfilePeakMemory", format_size(report["peak_memory"]))
+    slowest_files = _PROFILER.slowest_files(SLOWEST_FILE_COUNT)
+    if slowest_files:
+        printline()
+        printlog("ProfileSlowestFiles")
+        for file, wall_time in slowest_files:
+            printlog("ProfileFile", f"{wall_time:.2f}", file)
+    if save_report:
+        path = report_path(output_path)
+        with open(path, "w", encoding="utf8") as fp:
+            json.dump(report, fp, indent=2)
+        printline()
+        printlog("ProfileSaved", path.absolute())
+    stop_profiling()
@@ -0,0 +1,318 @@
+import hmac
+import json
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+from .batch import Job, JobResult, parse_job, run_job, start_job_pool
+from .configuration import Configuration, Settings
+from .logger import printline, printlog
+from .parallel import resolve_worker_count
+
+# the server only accepts connections from this computer
+SERVER_HOST = "127.0.0.1"
+# names of this computer accepted in the Host header, other names may point to it only to fool a browser
+ALLOWED_HOSTS = ("127.0.0.1", "localhost")
+MAX_JOB_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+# how many finished jobs are remembered, older ones are forgotten
+MAX_FINISHED_JOBS = 1000
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+JOB_STATUSES = {"JobMerged": "merged", "JobUpToDate": "up_to_date", "JobFailed": "failed"}
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class ServerJob:
+    number: int
+    job: Job
+    future: Future[JobResult]
+    queued_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    def result(self) -> JobResult:
+        try:
+            return self.future.result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # the worker process crashed or the server is stopping
+            return JobResult(self.number, Path(self.job.output_file), "JobFailed", error=str(e) or type(e).__name__)
+
+    def describe(self) -> dict:
+        data = {"id": self.number, "files": self.job.files, "output_file": self.job.output_file}
+        if not self.future.done():
+            data["status"] = "running" if self.future.running() else "queued"
+            data["seconds"] = time.time() - self.queued_at
+            return data
+        result = self.result()
+        data["status"] = JOB_STATUSES[result.status]
+        data["output_file"] = str(result.output.absolute())
+        data["pages"] = result.pages
+        data["merge_seconds"] = result.seconds
+        data["seconds"] = (self.finished_at or time.time()) - self.queued_at
+        if result.error:
+            data["error"] = result.error
+        return data
+
+
+class MergeServer:
+    """Runs merge jobs sent by other programs, `workers` of them at the same time.
+
+    Worker processes are started once and reused by all jobs, so a job does not pay for starting Python,
+    importing modules or reading the configuration. At most `queue_size` jobs can wait or run at once.
+    Files can be uploaded before a job. An uploaded file can be used by several jobs, it is removed when
+    the last job queued with it finishes (jobs sent after that cannot use it anymore).
+    """
+
+    def __init__(self, config: Configuration, settings: Settings, program_dir: Path, workers: int, queue_size: int):
+        # pylint: disable=too-many-arguments
+        self.config = config
+        self.settings = settings
+        self.program_dir = program_dir
+        self.queue_size = queue_size
+        self.pool: ProcessPoolExecutor = start_job_pool(workers, settings, program_dir)
+        self.upload_directory = Path(tempfile.mkdtemp(prefix="uploads_"))
+        self.jobs: dict[int, ServerJob] = {}
+        self._upload_users: dict[Path, int] = {}
+        """Number of unfinished jobs using every upload directory."""
+        self._lock = threading.Lock()
+        self._last_number = 0
+
+    def submit(self, entry: dict) -> ServerJob:
+        """Queues a job described like in a batch file. `force` can be given too."""
+        with self._lock:
+            if sum(1 for x in self.jobs.values() if not x.future.done()) >= self.queue_size:
+                raise QueueFull()
+            number = self._last_number + 1
+            force = entry.pop("force", False)
+            if not isinstance(force, bool):
+                raise ValueError("force is not true or false")
+            job = parse_job(entry, number, self.config, self.settings, self.program_dir)
+            self._last_number = number
+            future = self.pool.submit(run_job, job, number, force)
+            server_job = ServerJob(number, job, future)
+            self.jobs[number] = server_job
+            for directory in self._get_upload_directories(job):
+                self._upload_users[directory] = self._upload_users.get(directory, 0) + 1
+        future.add_done_callback(lambda _: self._finished(server_job))
+        return server_job
+
+    def _finished(self, server_job: ServerJob):
+        server_job.finished_at = time.time()
+        result = server_job.result()
+        printlog(result.status, result.number, result.output, result.pages, f"{result.seconds:.2f}", result.error)
+        with self._lock:
+            for directory in self._get_upload_directories(server_job.job):
+                self._upload_users[directory] -= 1
+                if self._upload_users[directory] == 0:
+                    del self._upload_users[directory]
+                    shutil.rmtree(directory, ignore_errors=True)
+            finished = [x for x in self.jobs.values() if x.future.done()]
+            for old_job in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self.jobs[old_job.number]
+
+    def _get_upload_directories(self, job: Job) -> set[Path]:
+        uploads = (Path(x).absolute() for x in job.files)
+        return {x.parent for x in uploads if x.parent.parent == self.upload_directory}
+
+    def get(self, number: int) -> ServerJob | None:
+        with self._lock:
+            return self.jobs.get(number)
+
+    def describe_jobs(self) -> list[dict]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [x.describe() for x in jobs]
+
+    def save_upload(self, name: str, stream, length: int) -> Path:
+        """Saves an uploaded file under its name (in its own directory) and returns its path."""
+        directory = self.upload_directory.joinpath(uuid.uuid4().hex)
+        directory.mkdir()
+        path = directory.joinpath(name)
+        with open(path, "wb") as fp:
+            while length > 0:
+                chunk = stream.read(min(length, UPLOAD_CHUNK_SIZE))
+                if not chunk:
+                    break
+                fp.write(chunk)
+                length -= len(chunk)
+        return path
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.upload_directory, ignore_errors=True)
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the merge server:
+
+    POST /jobs with a job like in a batch file ({"files": [...], "output_file": ..., settings...}) queues it,
+    GET /jobs lists all jobs, GET /jobs/ID returns the status and timing of a job,
+    GET /jobs/ID/output returns the merged PDF and POST /uploads/NAME stores the request body as a file
+    and returns its path, which can be used in "files".
+    """
+
+    server: "MergeHTTPServer"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # jobs are reported when they finish
+
+    def send_json(self, status: HTTPStatus, data):
+        body = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: HTTPStatus, message: str):
+        self.send_json(status, {"error": message})
+
+    def check_request(self) -> bool:
+        """Rejects requests that web pages opened in a browser could send (they always have an Origin header
+        or use another host name) and requests without the token, if one is set. Returns False if rejected.
+        """
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+        if host not in ALLOWED_HOSTS:
+            self.send_error_json(HTTPStatus.FORBIDDEN, "unknown host")
+            return False
+        if "Origin" in self.headers:
+            self.send_error_json(HTTPStatus.FORBIDDEN, "requests from web pages are not accepted")
+            return False
+        token = self.server.token
+        authorization = (self.headers.get("Authorization") or "").encode("latin-1", errors="replace")
+        if token and not hmac.compare_digest(authorization, f"Bearer {token}".encode("latin-1", errors="replace")):
+            self.send_error_json(HTTPStatus.UNAUTHORIZED, "missing or wrong token")
+            return False
+        return True
+
+    def get_content_length(self, limit: int) -> int | None:
+        """Returns the length of the request body. Sends an error and returns None if it is missing,
+        invalid or larger than `limit`.
+        """
+        value = self.headers.get("Content-Length")
+        if value is None:
+            self.send_error_json(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+            return None
+        if not value.strip().isdigit():
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "invalid Content-Length")
+            return None
+        length = int(value)
+        if length > limit:
+            self.send_error_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"body is larger than {limit} bytes")
+            return None
+        return length
+
+    def get_job(self, number: str) -> ServerJob | None:
+        server_job = self.server.merge_server.get(int(number)) if number.isdigit() else None
+        if server_job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "unknown job")
+        return server_job
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if not self.check_request():
+            return
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.send_json(HTTPStatus.OK, self.server.merge_server.describe_jobs())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            server_job = self.get_job(parts[1])
+            if server_job is not None:
+                self.send_json(HTTPStatus.OK, server_job.describe())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "output":
+            server_job = self.get_job(parts[1])
+            if server_job is not None:
+                self.send_output(server_job)
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "unknown path")
+
+    def send_output(self, server_job: ServerJob):
+        if not server_job.future.done():
+            self.send_error_json(HTTPStatus.CONFLICT, "job is not finished")
+            return
+        result = server_job.result()
+        if result.status == "JobFailed" or not result.output.is_file():
+            self.send_error_json(HTTPStatus.NOT_FOUND, "job has no output")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(result.output.stat().st_size))
+        self.end_headers()
+        with open(result.output, "rb") as fp:
+            shutil.copyfileobj(fp, self.wfile)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if not self.check_request():
+            return
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.post_job()
+        elif len(parts) == 2 and parts[0] == "uploads" and Path(unquote(parts[1])).name:
+            length = self.get_content_length(MAX_UPLOAD_SIZE)
+            if length is not None:
+                path = self.server.merge_server.save_upload(Path(unquote(parts[1])).name, self.rfile, length)
+                self.send_json(HTTPStatus.CREATED, {"path": str(path)})
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "unknown path")
+
+    def post_job(self):
+        if self.headers.get_content_type() != "application/json":
+            self.send_error_json(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Content-Type must be application/json")
+            return
+        length = self.get_content_length(MAX_JOB_SIZE)
+        if length is None:
+            return
+        try:
+            entry = json.loads(self.rfile.read(length))
+            if not isinstance(entry, dict):
+                raise ValueError("job is not a JSON object")
+            server_job = self.server.merge_server.submit(entry)
+        except QueueFull:
+            self.send_error_json(HTTPStatus.TOO_MANY_REQUESTS, "too many queued jobs")
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+        else:
+            self.send_json(HTTPStatus.ACCEPTED, server_job.describe())
+
+
+class MergeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, merge_server: MergeServer, token: str):
+        super().__init__((SERVER_HOST, port), MergeRequestHandler)
+        self.merge_server = merge_server
+        self.token = token
+
+
+def stop_serving(*_):
+    raise KeyboardInterrupt()
+
+
+def serve(config: Configuration, settings: Settings, program_dir: Path):
+    """Runs the merge server until it is stopped with CTRL-C (or SIGTERM).
+    Jobs get `settings` (resolved `config`) with their own values overriding them.
+    """
+    signal.signal(signal.SIGTERM, stop_serving)
+    workers = resolve_worker_count(settings.batch_workers, settings.server_queue_size)
+    merge_server = MergeServer(config, settings, program_dir, workers, settings.server_queue_size)
+    try:
+        with MergeHTTPServer(settings.server_port, merge_server, settings.server_token) as http_server:
+            printline()
+            printlog("ServerListening", f"http://{SERVER_HOST}:{http_server.server_port}", workers)
+            try:
+                http_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        merge_server.close()
+    printlog("ServerStopped")
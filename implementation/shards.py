@@ -0,0 +1,91 @@
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Sequence
+from .files import is_image_extension, is_pdf_extension, is_document_extension
+from .images import PreparedImage
+from .libre import TEMP_DIRECTORY
+from .output import OutputDocument
+
+# merging fewer files than that in a separate process is not worth it
+MIN_SHARD_SIZE = 8
+# more shards than processes, so that a slow shard does not leave other processes idle
+SHARDS_PER_JOB = 4
+
+# result of merge_shard
+MergedShard = tuple[Path | None, int, int, list[tuple[int, int]]]
+
+
+def split_into_shards(count: int, jobs: int) -> list[range]:
+    """Splits `count` files into contiguous ranges of similar length."""
+    shard_count = max(1, min(jobs * SHARDS_PER_JOB, count // MIN_SHARD_SIZE))
+    bounds = [count * i // shard_count for i in range(shard_count + 1)]
+    return [range(start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def get_source(file: Path, conversions: dict[Path, Future[Path]]) -> Path | None:
+    """Returns the path the file's pages should be read from, or None if the file cannot be merged."""
+    if is_pdf_extension(file) or is_image_extension(file):
+        return file
+    if is_document_extension(file) and file in conversions:
+        return conversions[file].result()
+    return None
+
+
+def merge_shard(
+    files: Sequence[Path],
+    sources: Sequence[Path | None],
+    prepare: Callable[[Path], PreparedImage],
+    shard_path: Path,
+    memory_budget: int,
+) -> MergedShard:
+    """Merges a part of the files into an intermediate PDF, like merge_documents would. Runs in a worker process.
+    Returns the path of the intermediate PDF (None if it would have no pages), the sizes of images
+    before and after preparing them and the number of pages and the size of inserted data of every file.
+    """
+    # pylint: disable=too-many-arguments
+    output_file = OutputDocument(shard_path, memory_budget, dry_run=False)
+    images_size_before = images_size_after = 0
+    file_pages = []
+    for file, source in zip(files, sources):
+        pages, inserted_size = output_file.page_count, output_file.inserted_size
+        if source is not None and is_image_extension(file):
+            prepared_image = prepare(source)
+            images_size_before += prepared_image.original_size
+            images_size_after += prepared_image.prepared_size
+            output_file.insert_bytes(prepared_image.page)
+        elif source is not None:
+            output_file.insert_file(source)
+        file_pages.append((output_file.page_count - pages, output_file.inserted_size - inserted_size))
+    if output_file.document.page_count == 0:
+        return (None, images_size_before, images_size_after, file_pages)
+    output_file.save()
+    return (shard_path, images_size_before, images_size_after, file_pages)
+
+
+def submit_shards(
+    files: Sequence[Path],
+    conversions: dict[Path, Future[Path]],
+    prepare: Callable[[Path], PreparedImage],
+    memory_budget: int,
+    jobs: int,
+    executor: ProcessPoolExecutor,
+    stack: ExitStack,
+) -> list[tuple[range, Future[MergedShard]]]:
+    """Submits merging of contiguous parts of `files` to the `jobs` worker processes of the executor.
+    Returns the range of files in every shard together with the future of merge_shard's result, in order.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,consider-using-with
+    os.makedirs(TEMP_DIRECTORY, exist_ok=True)
+    shard_directory = Path(stack.enter_context(tempfile.TemporaryDirectory(dir=TEMP_DIRECTORY)))
+    shards = []
+    for i, shard in enumerate(split_into_shards(len(files), jobs)):
+        shard_files = [files[j] for j in shard]
+        # waits for conversions of documents in this shard, earlier shards are already being merged meanwhile
+        sources = [get_source(file, conversions) for file in shard_files]
+        shard_path = shard_directory.joinpath(f"{i}.pdf")
+        future = executor.submit(merge_shard, shard_files, sources, prepare, shard_path, memory_budget // jobs)
+        shards.append((shard, future))
+    return shards
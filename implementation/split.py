@@ -0,0 +1,118 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Generator, NamedTuple, Sequence
+from .configuration import Settings
+from .output import OutputDocument
+from .shards import MergedShard
+
+
+class PartPiece(NamedTuple):
+    shard: Path
+    """Intermediate PDF merged by merge_shard."""
+    pages: range
+    """Pages of the intermediate PDF."""
+
+
+class SubmittedPart(NamedTuple):
+    path: Path
+    files: list[Path]
+    """Files whose last pages are in this part (or which cannot be merged and would be reported here)."""
+    future: Future[tuple[int, int]] | None
+    """Future of merge_part's result, None if the part has no pages."""
+    finished_shards: list[Path]
+    """Intermediate PDFs not needed by this or later parts."""
+
+
+def get_part_path(output_path: Path, number: int) -> Path:
+    return output_path.with_name(f"{output_path.stem}_{number:03}.pdf")
+
+
+def plan_parts(
+    files: Sequence[Path], shards: list[tuple[range, Future[MergedShard]]], max_pages: int, max_size: int
+) -> Generator[tuple[list[PartPiece], list[Path], list[Path]], None, None]:
+    """Splits pages of the merged shards into consecutive parts of at most `max_pages` pages and about `max_size`
+    bytes (0 means no limit). Shards report the pages and the inserted size of every file, so every file is opened
+    only once - by the worker merging its shard. The size of a page is estimated from the size of its file.
+    A file is split between parts if it does not fit. Yields pieces of every part together with the files
+    whose last pages are in it and the shards that are not needed by later parts.
+    Waits for the shards when they are reached.
+    """
+    pieces: list[PartPiece] = []
+    part_files: list[Path] = []
+    finished_shards: list[Path] = []
+    part_pages = 0
+    part_size = 0.0
+    for shard, future in shards:
+        shard_path, _, _, file_pages = future.result()
+        file_start = 0  # first page of the file in the shard
+        for file, (page_count, size) in zip((files[i] for i in shard), file_pages):
+            page_size = size / page_count if page_count else 0.0
+            start = 0
+            while start < page_count:
+                count = page_count - start
+                if max_pages > 0:
+                    count = min(count, max_pages - part_pages)
+                if max_size > 0 and page_size > 0:
+                    count = min(count, int((max_size - part_size) // page_size))
+                if count <= 0 and pieces:  # the part is full
+                    yield (pieces, part_files, finished_shards)
+                    pieces, part_files, finished_shards, part_pages, part_size = [], [], [], 0, 0.0
+                    continue
+                count = max(count, 1)  # a page larger than max_size gets a part of its own
+                pages = range(file_start + start, file_start + start + count)
+                if pieces and pieces[-1].shard == shard_path and pieces[-1].pages.stop == pages.start:
+                    # consecutive files of a shard are copied at once
+                    pieces[-1] = PartPiece(shard_path, range(pieces[-1].pages.start, pages.stop))
+                else:
+                    pieces.append(PartPiece(shard_path, pages))
+                part_pages += count
+                part_size += count * page_size
+                start += count
+            part_files.append(file)
+            file_start += page_count
+        if shard_path is not None:
+            finished_shards.append(shard_path)
+    if pieces or part_files:
+        yield (pieces, part_files, finished_shards)
+
+
+def merge_part(
+    pieces: Sequence[PartPiece], part_path: Path, memory_budget: int, dry_run: bool, compact: bool
+) -> tuple[int, int]:
+    """Copies pieces of merged shards into a part of the output and saves it. Runs in a worker process,
+    so a part takes only the memory of its own pages. Returns the number of pages and the size of inserted data.
+    """
+    output_file = OutputDocument(part_path, memory_budget, dry_run=dry_run, compact=compact)
+    for piece in pieces:
+        output_file.insert_file(piece.shard, pages=piece.pages)
+    pages = output_file.page_count
+    output_file.save()
+    return (pages, output_file.inserted_size)
+
+
+def submit_parts(
+    files: Sequence[Path],
+    shards: list[tuple[range, Future[MergedShard]]],
+    output_path: Path,
+    config: Settings,
+    workers: int,
+    executor: ProcessPoolExecutor,
+) -> list[SubmittedPart]:
+    """Submits merging and saving of parts of the output (see plan_parts) to the `workers` processes
+    of the executor, every part as soon as it is planned. Returns the parts in order.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    memory_budget = config.memory_budget * 1024 * 1024 // workers
+    parts: list[SubmittedPart] = []
+    part_number = 0
+    for pieces, part_files, finished_shards in plan_parts(
+        files, shards, config.split_pages, config.split_size * 1024 * 1024
+    ):
+        if not pieces:
+            parts.append(SubmittedPart(output_path, part_files, None, finished_shards))
+            continue
+        part_number += 1
+        part_path = get_part_path(output_path, part_number)
+        future = executor.submit(merge_part, pieces, part_path, memory_budget, config.whatif, config.compact_output)
+        parts.append(SubmittedPart(part_path, part_files, future, finished_shards))
+    return parts
@@ -1,15 +1,23 @@
+from multiprocessing import freeze_support
 from pathlib import Path
 import sys
-from implementation.merge import merge_documents
-from implementation.files import generate_name, recurse_files
-from implementation.logger import printline, set_language_from_file, printlog
-from implementation.commandline import regenerate_default_config, parse_arguments, load_config, wait_for_confirm
+import time
+from implementation.logger import set_language_from_file
+from implementation.commandline import (
+    regenerate_default_config,
+    parse_arguments,
+    load_config,
+    resolve_config,
+    wait_for_confirm,
+)
 
 # if main script is in a folder called _internal, it means it's part of a generated exe
 # it means that langueage and config files should be one level above, where the .exe is.
 PROGRAM_DIR = Path(__file__).parent.parent.parent if getattr(sys, "frozen", False) else Path(__file__).parent
 
 if __name__ == "__main__":
+    # worker processes of a generated exe have to be started through the exe itself
+    freeze_support()
     # print(PROGRAM_DIR)
     # REGENERATE CONFIG
     default_config_path = PROGRAM_DIR.joinpath("config.toml")
@@ -27,17 +35,26 @@ if __name__ == "__main__":
     # MAYBE SAVE CONFIG
     if args.save_config:
         config.save_config(args.save_config)
-    # GET FILES
-    files_to_process = recurse_files(args.files, config.alphabetic_file_sorting, config.recursion_limit)
-    # GET OUTPUT PATH
-    if args.output_file:  # Output_file has precedence if specified
-        output = Path(args.output_file)
-    else:
-        output = generate_name(config.output_directory_expanded(PROGRAM_DIR))
+    # RESOLVE CONFIG
+    settings = resolve_config(config, PROGRAM_DIR)
     # MERGE
-    merge_documents(files_to_process, output, config)
-    if config.whatif:
-        printline()
-        printlog("WhatIfMode")
+    # imported only now, so that printing help or saving the config does not wait for the merge modules
+    # pylint: disable=import-outside-toplevel
+    from implementation.batch import get_output_path, load_jobs, print_batch_summary, run_batch, run_merge
+
+    results = []
+    if args.serve:
+        from implementation.server import serve
+
+        serve(config, settings, PROGRAM_DIR)
+    elif args.batch:
+        jobs = load_jobs(args.batch, config, settings, PROGRAM_DIR)
+        start = time.perf_counter()
+        results = run_batch(jobs, settings, PROGRAM_DIR, args.force)
+        print_batch_summary(results, time.perf_counter() - start)
+    else:
+        run_merge(args.files, get_output_path(args.output_file, settings), settings, args.force)
     # WAIT FOR CONFIRM
-    wait_for_confirm(wait=config.confirm_exit and not config.quiet)
+    wait_for_confirm(wait=settings.confirm_exit and not settings.quiet)
+    if any(x.status == "JobFailed" for x in results):
+        sys.exit(1)